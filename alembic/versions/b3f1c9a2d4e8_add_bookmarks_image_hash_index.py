@@ -0,0 +1,34 @@
+"""add_bookmarks_image_hash_index
+
+Revision ID: b3f1c9a2d4e8
+Revises: 7e84b87e3df7
+Create Date: 2026-10-16 09:12:31.402117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3f1c9a2d4e8'
+down_revision: Union[str, None] = '7e84b87e3df7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Expression index backing crud.get_bookmark_by_image_hash (OCR short-circuit)
+    op.create_index(
+        'ix_bookmarks_image_hash',
+        'bookmarks',
+        [sa.text("json_extract(metadata_json, '$.image_hash')")],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_bookmarks_image_hash', table_name='bookmarks')
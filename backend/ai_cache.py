@@ -0,0 +1,158 @@
+"""In-process caching for AI (Gemini) responses."""
+import asyncio
+import functools
+import hashlib
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import orjson
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# --- Cache Settings ---
+RESPONSE_CACHE_MAXSIZE = 1024
+RESPONSE_CACHE_TTL_SECONDS = 3600 # Summaries/key points/flashcards for a chapter rarely need regenerating within an hour
+SOLVER_CACHE_TTL_SECONDS = 24 * 3600 # A math problem's solution doesn't go stale; the daily puzzle is keyed by date
+QUESTION_POOL_MAXSIZE = 256 # Number of (chapter, type) pools kept
+QUESTION_POOL_CAPACITY = 8 # Questions held per pool
+QUESTION_POOL_LOW_WATER = 3 # Refill in the background once a pool drops below this
+QUESTION_POOL_MAX_CONCURRENT_REFILLS = 4 # Background Gemini calls allowed at once across all pools
+QUESTION_POOL_FAILURE_BACKOFF_SECONDS = 300 # After a failed refill, leave that pool alone this long (quota/auth outages)
+
+
+def make_cache_key(fn: str, **parts: Any) -> str:
+    """Stable key for an AI call: the function name plus its (JSON-serializable) inputs."""
+    payload = orjson.dumps({"fn": fn, **parts}, option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(payload).hexdigest()
+
+
+class LLMCache:
+    """Key -> response cache with a TTL. Only successful responses should be stored."""
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_MAXSIZE, ttl: int = RESPONSE_CACHE_TTL_SECONDS):
+        self._store: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key: str) -> Optional[Any]:
+        return self._store.get(key)
+
+    def set(self, key: str, value: Any) -> None:
+        self._store[key] = value
+
+
+class QuestionPool:
+    """Pre-generated questions per key, handed out one at a time so users don't all see the same question."""
+
+    def __init__(self, maxsize: int = QUESTION_POOL_MAXSIZE, capacity: int = QUESTION_POOL_CAPACITY):
+        self._pools: TTLCache = TTLCache(maxsize=maxsize, ttl=RESPONSE_CACHE_TTL_SECONDS)
+        self._capacity = capacity
+        self._refilling: set = set()
+        self._tasks: set = set() # Strong references so background refills aren't garbage-collected
+        self._semaphore = asyncio.Semaphore(QUESTION_POOL_MAX_CONCURRENT_REFILLS)
+        self._backoff: TTLCache = TTLCache(maxsize=maxsize, ttl=QUESTION_POOL_FAILURE_BACKOFF_SECONDS) # Keys whose last refill failed
+
+    def pop(self, key: str) -> Optional[Any]:
+        pool = self._pools.get(key)
+        return pool.popleft() if pool else None
+
+    def size(self, key: str) -> int:
+        pool = self._pools.get(key)
+        return len(pool) if pool else 0
+
+    def add(self, key: str, item: Any) -> None:
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = deque(maxlen=self._capacity)
+            self._pools[key] = pool
+        pool.append(item)
+
+    def schedule_refill(self, key: str, generate: Callable[[], Awaitable[Any]]) -> None:
+        """Top the pool for `key` up to capacity in a background task (at most one refill per key at a time)."""
+        if key in self._refilling or key in self._backoff:
+            return
+        self._refilling.add(key)
+        task = asyncio.create_task(self._refill(key, generate))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _limited(self, generate: Callable[[], Awaitable[Any]]) -> Any:
+        async with self._semaphore:
+            return await generate()
+
+    async def _refill(self, key: str, generate: Callable[[], Awaitable[Any]]) -> None:
+        try:
+            missing = self._capacity - self.size(key)
+            if missing <= 0:
+                return
+            # One call first, so a failing upstream costs a single call per backoff period rather than a full pool
+            try:
+                self.add(key, await self._limited(generate))
+            except Exception as e:
+                self._fail(key, e)
+                return
+            results = await asyncio.gather(*(self._limited(generate) for _ in range(missing - 1)), return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    self._fail(key, result)
+                else:
+                    self.add(key, result)
+        finally:
+            self._refilling.discard(key)
+
+    def _fail(self, key: str, error: Exception) -> None:
+        logger.warning("Question pool refill for %s failed: %s", key[:12], error)
+        self._backoff[key] = True
+
+
+# --- Single-Flight ---
+# Key -> task running the call currently in flight for that key
+_inflight: Dict[str, asyncio.Future] = {}
+
+async def single_flight(key: str, make_call: Callable[[], Awaitable[Any]]) -> Any:
+    """Runs make_call() once per key at a time; concurrent callers with the same key await the same result.
+
+    The call runs as its own task, so a caller that gives up (client disconnect, retry, timeout)
+    doesn't cancel it for the others; it still finishes and fills the cache.
+    """
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(make_call())
+        _inflight[key] = task
+        task.add_done_callback(functools.partial(_end_flight, key))
+    return await asyncio.shield(task)
+
+def _end_flight(key: str, task: asyncio.Future) -> None:
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    if not task.cancelled():
+        task.exception() # Mark as retrieved; waiters (if any) re-raise it themselves
+
+
+def cached_response(fn_name: str, cache: LLMCache, key_args: Optional[Callable[..., Any]] = None):
+    """Caches an async AI function's result per positional args. Exceptions (e.g. HTTPException) are never cached.
+
+    Concurrent misses for the same key are coalesced into a single call. `key_args`, if given, maps the
+    call's args to what goes into the key (e.g. to normalize names).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args):
+            key = make_cache_key(fn_name, args=key_args(*args) if key_args else list(args))
+            cached = cache.get(key)
+            if cached is not None:
+                logger.info("AI response cache hit for %s%s", fn_name, args)
+                return cached
+            async def call_and_store():
+                result = await func(*args)
+                cache.set(key, result)
+                return result
+            return await single_flight(key, call_and_store)
+        return wrapper
+    return decorator
+
+
+# Shared instances
+response_cache = LLMCache()
+solver_cache = LLMCache(ttl=SOLVER_CACHE_TTL_SECONDS)
+question_pool = QuestionPool()
@@ -0,0 +1,163 @@
+"""Gemini REST client shared across requests (native async I/O via httpx)."""
+import json
+import logging
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+GEMINI_API_BASE = "https://generativelanguage.googleapis.com/v1beta"
+DEFAULT_MODEL = "gemini-1.5-flash-latest"
+REQUEST_TIMEOUT_SECONDS = 30.0
+# Connection pool bounds; with HTTP/2 most concurrent calls share a few multiplexed connections
+HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+
+
+class AIServiceError(Exception):
+    """Gemini returned an HTTP error (bad key, quota, server error, ...)."""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"Gemini API error {status_code}: {message}")
+        self.status_code = status_code
+
+
+class AIBlockedError(Exception):
+    """The prompt or response was blocked by Gemini's safety filters."""
+
+    def __init__(self, block_reason: str):
+        super().__init__(f"AI content generation blocked. Reason: {block_reason}")
+        self.block_reason = block_reason
+
+
+class AIEmptyResponseError(Exception):
+    """Gemini answered but returned no text."""
+
+    def __init__(self):
+        super().__init__("AI model returned an unexpected or empty response.")
+
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def is_configured() -> bool:
+    return bool(config.GOOGLE_API_KEY)
+
+
+def _new_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=GEMINI_API_BASE,
+        http2=True,
+        timeout=REQUEST_TIMEOUT_SECONDS,
+        limits=HTTP_LIMITS,
+        headers={"x-goog-api-key": config.GOOGLE_API_KEY or ""},
+    )
+
+
+def get_client() -> httpx.AsyncClient:
+    """The shared client; created lazily if used outside the app lifespan (e.g. scripts)."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _new_client()
+    return _client
+
+
+async def startup() -> None:
+    get_client()
+    logger.info("Gemini HTTP client started.")
+
+
+async def shutdown() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        logger.info("Gemini HTTP client closed.")
+
+
+def _raise_for_error(response: httpx.Response) -> None:
+    if response.is_success:
+        return
+    try:
+        message = response.json().get("error", {}).get("message", response.text)
+    except ValueError:
+        message = response.text
+    raise AIServiceError(response.status_code, message)
+
+
+def _extract_text(data: Dict[str, Any]) -> str:
+    """Joins the text parts of the first candidate, raising if the request was blocked or empty."""
+    block_reason = data.get("promptFeedback", {}).get("blockReason")
+    if block_reason:
+        raise AIBlockedError(block_reason)
+    candidates = data.get("candidates") or []
+    if not candidates:
+        raise AIEmptyResponseError()
+    parts = candidates[0].get("content", {}).get("parts", [])
+    text = "".join(part.get("text", "") for part in parts)
+    if not text:
+        finish_reason = candidates[0].get("finishReason")
+        if finish_reason == "SAFETY":
+            raise AIBlockedError(finish_reason)
+        raise AIEmptyResponseError()
+    return text
+
+
+async def generate(prompt: str, model: str = DEFAULT_MODEL) -> str:
+    """Sends a single-turn text prompt to Gemini and returns the response text."""
+    response = await get_client().post(
+        f"/models/{model}:generateContent",
+        json={"contents": [{"parts": [{"text": prompt}]}]},
+    )
+    _raise_for_error(response)
+    return _extract_text(response.json())
+
+
+def _chunk_text(data: Dict[str, Any]) -> str:
+    """Text of one streamed chunk. Unlike _extract_text, an empty chunk is fine (e.g. the final finishReason chunk)."""
+    block_reason = data.get("promptFeedback", {}).get("blockReason")
+    if block_reason:
+        raise AIBlockedError(block_reason)
+    candidates = data.get("candidates") or []
+    if not candidates:
+        return ""
+    if candidates[0].get("finishReason") == "SAFETY":
+        raise AIBlockedError("SAFETY")
+    parts = candidates[0].get("content", {}).get("parts", [])
+    return "".join(part.get("text", "") for part in parts)
+
+
+async def generate_stream(prompt: str, model: str = DEFAULT_MODEL) -> AsyncIterator[str]:
+    """Like generate(), but yields the response text chunk by chunk as Gemini produces it (SSE)."""
+    async with get_client().stream(
+        "POST",
+        f"/models/{model}:streamGenerateContent",
+        params={"alt": "sse"},
+        json={"contents": [{"parts": [{"text": prompt}]}]},
+    ) as response:
+        if not response.is_success:
+            await response.aread() # Error bodies are small; read them so _raise_for_error can parse the message
+            _raise_for_error(response)
+        received_text = False
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            text = _chunk_text(json.loads(line[len("data:"):]))
+            if text:
+                received_text = True
+                yield text
+        if not received_text:
+            raise AIEmptyResponseError()
+
+
+async def generate_lines(prompt: str, model: str = DEFAULT_MODEL) -> AsyncIterator[str]:
+    """Streams the response like generate_stream(), but re-chunked into complete lines (without the newline)."""
+    pending = ""
+    async for chunk in generate_stream(prompt, model):
+        *lines, pending = (pending + chunk).split("\n")
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
@@ -28,6 +28,8 @@ logger = logging.getLogger(__name__) # Create a logger instance for this module
 
 # NEW: OAuth2 Scheme (moved from main.py)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/login") # Ensure tokenUrl matches your login route in main.py
+# Same scheme, but doesn't reject requests without a token (for endpoints where auth is optional)
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="/api/login", auto_error=False)
 
 # Password hashing context (we'll stick to bcrypt directly for verification for now)
 # pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -106,4 +108,13 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         raise credentials_exception
     
     logger.info(f"get_current_user (auth_utils): User '{email}' found in DB. Returning user object.")
-    return user 
\ No newline at end of file
+    return user
+
+async def get_current_user_optional(token: Optional[str] = Depends(oauth2_scheme_optional), db: Session = Depends(get_db)) -> Optional[UserModel]:
+    """Like get_current_user, but returns None instead of raising when no valid token is sent."""
+    if not token:
+        return None
+    try:
+        return await get_current_user(token=token, db=db)
+    except HTTPException:
+        return None
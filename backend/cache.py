@@ -0,0 +1,76 @@
+"""Shared JSON cache for expensive results (OCR text, solutions, graphs).
+
+Backed by Redis when REDIS_URL is set, so all workers share hits; otherwise an in-process cache.
+"""
+import asyncio
+import hashlib
+import logging
+from typing import Any, Optional
+
+import orjson
+from cachetools import TLRUCache
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+# --- Cache Settings ---
+LOCAL_CACHE_MAXSIZE = 2048 # Entries kept by the in-process fallback
+OCR_CACHE_TTL_SECONDS = 30 * 24 * 3600 # An image's text never changes
+SOLVE_CACHE_TTL_SECONDS = 7 * 24 * 3600
+GRAPH_CACHE_TTL_SECONDS = 30 * 24 * 3600 # Rendering is deterministic
+
+# --- Optional: Redis ---
+_redis = None
+try:
+    if config.REDIS_URL:
+        import redis.asyncio as redis_asyncio
+        _redis = redis_asyncio.from_url(config.REDIS_URL) # Connects lazily on first command
+        logger.info("Shared cache using Redis.")
+except ImportError:
+    logger.warning("REDIS_URL is set but the redis package is not installed. Using an in-process cache.")
+except Exception as e:
+    logger.error(f"Error configuring Redis cache: {e}. Using an in-process cache.")
+    _redis = None
+
+# Fallback: key -> (ttl, JSON bytes); TLRUCache evicts each entry at its own expiry
+_local: TLRUCache = TLRUCache(maxsize=LOCAL_CACHE_MAXSIZE, ttu=lambda _key, value, now: now + value[0])
+
+
+def content_key(prefix: str, content: str) -> str:
+    """Content-addressed key, e.g. content_key("graph", "x^2") -> "graph:<sha256>"."""
+    return f"{prefix}:{hashlib.sha256(content.encode()).hexdigest()}"
+
+
+async def get_json(key: str) -> Optional[Any]:
+    """The cached value for `key`, or None. A Redis outage or a lookup over REDIS_LOOKUP_TIMEOUT_MS counts as a miss."""
+    if _redis is None:
+        entry = _local.get(key)
+        return orjson.loads(entry[1]) if entry is not None else None
+    try:
+        raw = await asyncio.wait_for(_redis.get(key), config.REDIS_LOOKUP_TIMEOUT_MS / 1000)
+    except asyncio.TimeoutError:
+        logger.warning(f"Redis GET for {key} exceeded {config.REDIS_LOOKUP_TIMEOUT_MS} ms; treating as a miss.")
+        return None
+    except Exception as e:
+        logger.warning(f"Redis GET failed for {key}: {e}")
+        return None
+    return orjson.loads(raw) if raw is not None else None
+
+
+async def set_json(key: str, value: Any, ttl: int) -> None:
+    """Stores a JSON-serializable value under `key` for `ttl` seconds. Failures are logged, not raised."""
+    payload = orjson.dumps(value)
+    if _redis is None:
+        _local[key] = (ttl, payload)
+        return
+    try:
+        await _redis.set(key, payload, ex=ttl)
+    except Exception as e:
+        logger.warning(f"Redis SET failed for {key}: {e}")
+
+
+async def shutdown() -> None:
+    if _redis is not None:
+        await _redis.aclose()
+        logger.info("Redis cache connection closed.")
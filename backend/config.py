@@ -27,6 +27,34 @@ UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
 # Allowed file extensions for uploads
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf'}
 
+# Keep a copy of each uploaded image in UPLOAD_FOLDER (OCR itself works in memory)
+DEBUG_SAVE_UPLOADS = os.getenv("DEBUG_SAVE_UPLOADS", "0").lower() in ("1", "true")
+
+# Largest image (in bytes) the OCR path will read into memory; default 10 MB
+IMAGE_MAX_FILE_BYTES = int(os.getenv("IMAGE_MAX_FILE_BYTES", "10485760"))
+
+# Redis for the shared OCR/solver/graph cache (e.g. redis://localhost:6379/0); in-process cache when unset
+REDIS_URL = os.getenv("REDIS_URL")
+# Budget for a Redis cache read; a slower lookup is treated as a miss rather than delaying the request
+REDIS_LOOKUP_TIMEOUT_MS = int(os.getenv("REDIS_LOOKUP_TIMEOUT_MS", "50"))
+
+# Local Piper voice model (.onnx) for on-device text-to-speech; gTTS is used when unset
+PIPER_VOICE_PATH = os.getenv("PIPER_VOICE_PATH")
+
+# On-disk TTS clip cache: a private directory (created 0700), trimmed oldest-first once it exceeds TTS_DISK_CACHE_MAX_BYTES
+TTS_DISK_CACHE_DIR = os.getenv("TTS_DISK_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "math_wiz", "tts"))
+TTS_DISK_CACHE_MAX_BYTES = int(os.getenv("TTS_DISK_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+
+# Upstream AI call limits per worker: calls running at once, extra requests allowed to queue (then 503), and per-call timeout
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+OCR_CONCURRENCY = int(os.getenv("OCR_CONCURRENCY", "4"))
+UPSTREAM_MAX_WAITING = int(os.getenv("UPSTREAM_MAX_WAITING", "32"))
+UPSTREAM_TIMEOUT_SECONDS = float(os.getenv("UPSTREAM_TIMEOUT_SECONDS", "30"))
+
+# Uvicorn worker processes when started via `python -m backend.main` (e.g. 2 * cores + 1 in production).
+# In-process caches are per worker; set REDIS_URL to share them.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
 # Add other configurations here as needed, e.g.:
 # MATHPIX_APP_ID = os.getenv("MATHPIX_APP_ID")
 # MATHPIX_APP_KEY = os.getenv("MATHPIX_APP_KEY")
@@ -1,3 +1,4 @@
+from sqlalchemy import func, insert, literal_column
 from sqlalchemy.orm import Session
 from . import schemas # Ensure this matches your Pydantic schemas location
 from .models.user import User as UserModel # Corrected import
@@ -47,13 +48,15 @@ def increment_user_xp(db: Session, user_id: int, amount: int) -> Optional[UserMo
 
 def create_bookmark(db: Session, bookmark_data: BookmarkCreate, user_id: int) -> BookmarkModel:
     """Creates a new bookmark for a user."""
-    db_bookmark = BookmarkModel(
-        **bookmark_data.dict(), # Spread fields from Pydantic model
-        user_id=user_id
+    # INSERT ... RETURNING creates and loads the row (incl. server-side created_at) in one round trip
+    stmt = (
+        insert(BookmarkModel)
+        .values(**bookmark_data.model_dump(), user_id=user_id) # Spread fields from Pydantic model
+        .returning(BookmarkModel)
     )
-    db.add(db_bookmark)
+    db_bookmark = db.scalars(stmt).one()
+    db.expunge(db_bookmark) # Keep the returned attributes; commit would otherwise expire them and force a re-SELECT
     db.commit()
-    db.refresh(db_bookmark)
     return db_bookmark
 
 def get_bookmarks_by_user(db: Session, user_id: int, skip: int = 0, limit: int = 100) -> List[BookmarkModel]:
@@ -67,6 +70,16 @@ def get_bookmarks_by_user(db: Session, user_id: int, skip: int = 0, limit: int =
         .all()
     )
 
+def get_bookmark_by_image_hash(db: Session, user_id: int, image_hash: str) -> Optional[BookmarkModel]:
+    """Finds a user's bookmark whose metadata_json carries the given image hash (from OCR uploads)."""
+    # Rendered inline (not as a bound parameter) so SQLite can use ix_bookmarks_image_hash
+    image_hash_expr = func.json_extract(BookmarkModel.metadata_json, literal_column("'$.image_hash'"))
+    return (
+        db.query(BookmarkModel)
+        .filter(BookmarkModel.user_id == user_id, image_hash_expr == image_hash)
+        .first()
+    )
+
 def delete_bookmark(db: Session, bookmark_id: int, user_id: int) -> Optional[BookmarkModel]:
     """Deletes a specific bookmark owned by a user."""
     db_bookmark = (
@@ -0,0 +1,67 @@
+"""Concurrency limits for upstream AI calls (Gemini solve/OCR), with backpressure instead of a thundering herd."""
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
+
+from fastapi import HTTPException
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+RETRY_AFTER_SECONDS = 5 # Suggested client back-off when a limiter's queue is full
+
+
+class UpstreamLimiter:
+    """Runs at most `concurrency` calls at once; up to `max_waiting` more queue for a slot.
+
+    Beyond that the request is refused with 503 + Retry-After, and a call that runs longer
+    than `timeout` seconds is abandoned with 504 so it can't hold its slot forever.
+    """
+
+    def __init__(self, name: str, concurrency: int, max_waiting: int, timeout: float):
+        self.name = name
+        self._sem = asyncio.Semaphore(max(1, concurrency))
+        self._max_waiting = max_waiting
+        self._timeout = timeout
+        self._waiting = 0
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Holds one slot for the whole block, e.g. while a streamed response is read; 503 when the queue is full."""
+        if self._sem.locked() and self._waiting >= self._max_waiting:
+            logger.warning(f"{self.name} limiter full ({self._waiting} waiting); rejecting request.")
+            raise HTTPException(
+                status_code=503,
+                detail="The AI service is busy. Please try again shortly.",
+                headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+            )
+        self._waiting += 1
+        try:
+            await self._sem.acquire()
+        finally:
+            self._waiting -= 1
+        try:
+            yield
+        finally:
+            self._sem.release()
+
+    async def timed(self, awaitable: Awaitable[T]) -> T:
+        """Awaits one upstream step (a call, or the next chunk of a stream); 504 after `timeout` seconds."""
+        try:
+            return await asyncio.wait_for(awaitable, self._timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"{self.name} call timed out after {self._timeout}s.")
+            raise HTTPException(status_code=504, detail="The AI service took too long to respond.")
+
+    async def run(self, make_call: Callable[[], Awaitable[T]]) -> T:
+        async with self.slot():
+            return await self.timed(make_call())
+
+
+# Shared per-worker limits, acquired around the upstream request only (after cache checks)
+llm_limiter = UpstreamLimiter("Gemini solve", config.LLM_CONCURRENCY, config.UPSTREAM_MAX_WAITING, config.UPSTREAM_TIMEOUT_SECONDS)
+ocr_limiter = UpstreamLimiter("Gemini OCR", config.OCR_CONCURRENCY, config.UPSTREAM_MAX_WAITING, config.UPSTREAM_TIMEOUT_SECONDS)
@@ -1,15 +1,24 @@
 import os
-import shutil
+import asyncio
+import atexit
+import hashlib
+import orjson
+import aiofiles
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import logging
+import logging.handlers
+import queue
 from datetime import timedelta # Added timedelta for token expiry
 from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Query, Depends
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm # Added OAuth2
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from typing import List, Dict, Any, Optional
 import io
 import re
-from fastapi.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
+from cachetools import LRUCache
 from datetime import date # Add date for daily puzzle
 
 from . import config # Use relative import
@@ -20,6 +29,10 @@ from . import speech   # Use relative import
 from . import utils    # Use relative import
 from . import graphing # Import the new graphing module
 from . import auth_utils # Added import for auth_utils
+from . import ai_utils # Shared async HTTP client for Gemini REST calls
+from . import cache # Shared (Redis) cache for OCR, solver and graph results
+from .ai_cache import single_flight
+from .sse import prime_stream, sse_event, sse_error
 from .database import get_db # ADDED
 from sqlalchemy.orm import Session # ADDED
 from . import crud # ADDED
@@ -34,7 +47,21 @@ from .auth_utils import get_current_user, oauth2_scheme # <-- IMPORT MOVED FUNCT
 
 # ---> MOVE Logging Setup UP <---
 # --- Logging Setup ---
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+class _DeferredFormatQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that enqueues the record as-is. The stock prepare() formats it (message, timestamp,
+    traceback) on the emitting thread; here that happens in the listener's handler instead."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record # Same process (SimpleQueue), so the record needs no pickling-safe copy
+
+# Records are only enqueued on the event loop; the listener thread formats and writes them
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_log_stream_handler = logging.StreamHandler()
+_log_stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream_handler, respect_handler_level=True)
+logging.basicConfig(level=logging.INFO, handlers=[_DeferredFormatQueueHandler(_log_queue)])
+_log_listener.start() # Started at import so import-time messages are written too
+atexit.register(_log_listener.stop) # Flushes queued records once, at interpreter exit (not per lifespan)
 logger = logging.getLogger(__name__)
 # ---> END MOVE <---
 
@@ -52,15 +79,37 @@ except ImportError:
     logger.warning("google-generativeai package not installed. Gemini features in main.py disabled.")
 except Exception as e:
     logger.error(f"Error configuring Google Generative AI in main.py: {e}")
+
+# Shared model instances (practice problems and chat); created once instead of per request
+_GEMINI_MODEL = genai.GenerativeModel('gemini-1.5-flash-latest') if genai else None
 # ---> END ADDITION <---
 
+# --- App Lifespan (startup/shutdown of shared clients) ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _graph_executor
+    await ai_utils.startup()
+    _graph_executor = _new_graph_executor()
+    prefetch_task = None
+    if ai_utils.is_configured():
+        prefetch_task = asyncio.create_task(cs_router.prefetch_questions_loop()) # Keeps popular question pools warm
+    yield
+    if prefetch_task is not None:
+        prefetch_task.cancel()
+    _graph_executor.shutdown(wait=False, cancel_futures=True)
+    _graph_executor = None
+    await ai_utils.shutdown()
+    await cache.shutdown()
+
 # --- FastAPI App Initialization ---
 app = FastAPI(
     title="Math Wiz Assistant API",
     description="API for solving math problems from text or images.",
     version="0.1.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse, # orjson serializes the large graph data URLs and solutions much faster
 )
-print("!!! DEBUG: FastAPI app object created !!!")
+logger.debug("FastAPI app object created.")
 
 # Include the new router
 app.include_router(bookmarks_router.router) # NEW
@@ -83,12 +132,14 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=origins, # Allows specific origins
     allow_credentials=True, # Allows cookies/authorization headers
-    allow_methods=["*"],    # Allows all methods (GET, POST, PUT, etc.)
-    allow_headers=["*"],    # Allows all headers
+    allow_methods=["GET", "POST", "DELETE", "OPTIONS"], # Explicit lists skip the per-preflight wildcard echo
+    allow_headers=["Content-Type", "Authorization"],
+    expose_headers=["ETag"], # Lets the frontend read the ETag to tell whether a result changed
 )
 
-# --- Ensure Upload Directory Exists ---
-os.makedirs(config.UPLOAD_FOLDER, exist_ok=True)
+# --- Ensure Upload Directory Exists (only used when uploads are kept for debugging) ---
+if config.DEBUG_SAVE_UPLOADS:
+    os.makedirs(config.UPLOAD_FOLDER, exist_ok=True)
 
 # --- Helper Functions (Consider moving to utils.py later) ---
 def is_allowed_file(filename: str):
@@ -153,7 +204,7 @@ def call_gemini_for_solution(problem: str) -> Dict[str, Any]:
     """
     Placeholder function to simulate calling Gemini for a step-by-step solution.
     """
-    print(f"Simulating Gemini call for problem: {problem[:50]}...")
+    logger.info(f"Simulating Gemini call for problem: {problem[:50]}...")
     # TODO: Implement actual Gemini API call here
     # Construct the prompt asking for numbered steps in JSON format
     # Make the API request using your key/SDK
@@ -192,7 +243,7 @@ def call_gemini_for_explanation(
     Placeholder function to simulate calling Gemini for a step explanation.
     """
     step_num = step_to_explain.get("step_number", "N/A")
-    print(f"Simulating Gemini call to explain step {step_num} ({query_type}) for problem: {problem[:50]}...")
+    logger.info(f"Simulating Gemini call to explain step {step_num} ({query_type}) for problem: {problem[:50]}...")
     # TODO: Implement actual Gemini API call here
     # Construct the prompt providing context:
     # - Original problem
@@ -232,6 +283,32 @@ async def call_recognition_service(image_data_url: str) -> Dict[str, Any]:
 # ---> END ADDITION <---
 
 # ---> REPLACE Placeholder Practice Problem Function with Gemini Implementation <---
+# Prompt templates are module constants, filled per request with str.format_map
+_PRACTICE_PROMPT_TEMPLATE = """You are a math tutor.
+Generate a practice problem suitable for a student learning about "{topic}".
+Clearly state the problem.
+{previous_problem_context}
+Then, provide a detailed step-by-step solution and explanation for the specific new problem you generated.
+
+Format your response like this:
+
+Problem:
+[State the practice problem here]
+
+Solution & Explanation:
+[Provide the full solution steps and explanation here]
+"""
+
+_PRACTICE_FOLLOWUP_TEMPLATE = """
+The student was just given the following problem:
+Previous Problem: {previous_problem}
+Please generate a DIFFERENT practice problem on the same topic ("{topic}") with a similar difficulty level.
+"""
+
+_PRACTICE_FIRST_PROBLEM_CONTEXT = """
+This is the first practice problem requested for this topic.
+"""
+
 async def call_gemini_for_practice(topic: str, previous_problem: Optional[str] = None) -> Dict[str, Any]:
     """
     Calls Gemini to generate a practice problem and its solution/explanation for a given topic,
@@ -245,36 +322,14 @@ async def call_gemini_for_practice(topic: str, previous_problem: Optional[str] =
         return {"error": "Practice problem generation via AI model is not configured on the server."}
 
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash-latest') # Use a capable model
-
-        # Construct the prompt, adding context if a previous problem was given
-        prompt = f"""You are a math tutor.
-Generate a practice problem suitable for a student learning about "{topic}".
-Clearly state the problem.
-"""
+        model = _GEMINI_MODEL
 
+        # Fill the prompt template, adding context if a previous problem was given
         if previous_problem:
-            prompt += f"""
-The student was just given the following problem:
-Previous Problem: {previous_problem}
-Please generate a DIFFERENT practice problem on the same topic ("{topic}") with a similar difficulty level.
-"""
+            previous_problem_context = _PRACTICE_FOLLOWUP_TEMPLATE.format_map({"topic": topic, "previous_problem": previous_problem})
         else:
-             prompt += """
-This is the first practice problem requested for this topic.
-"""
-        
-        prompt += """
-Then, provide a detailed step-by-step solution and explanation for the specific new problem you generated.
-
-Format your response like this:
-
-Problem:
-[State the practice problem here]
-
-Solution & Explanation:
-[Provide the full solution steps and explanation here]
-"""
+            previous_problem_context = _PRACTICE_FIRST_PROBLEM_CONTEXT
+        prompt = _PRACTICE_PROMPT_TEMPLATE.format_map({"topic": topic, "previous_problem_context": previous_problem_context})
 
         logger.info(f"Sending request to Gemini model ({model.model_name}) for practice problem.")
         response = await model.generate_content_async(prompt)
@@ -349,7 +404,7 @@ async def call_gemini_for_chat_message(user_question: str, chat_history: Optiona
         return "Error: The AI chat service is not configured on the server."
 
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash-latest') # Or your preferred chat model
+        model = _GEMINI_MODEL
         
         # Construct the prompt with history
         prompt_parts = []
@@ -362,10 +417,10 @@ async def call_gemini_for_chat_message(user_question: str, chat_history: Optiona
             prompt_parts.append("\nHere is the recent conversation history for context (last user message is the current question):")
             for message in chat_history:
                 # Simple formatting for history. More sophisticated role mapping might be needed for some models.
-                if message.sender == 'user':
-                    prompt_parts.append(f'User previously asked: "{message.text}"')
-                elif message.sender == 'ai':
-                    prompt_parts.append(f'You previously responded: "{message.text}"')
+                if message["sender"] == 'user':
+                    prompt_parts.append(f'User previously asked: "{message["text"]}"')
+                elif message["sender"] == 'ai':
+                    prompt_parts.append(f'You previously responded: "{message["text"]}"')
         
         prompt_parts.append(f'\nUser\'s current question: "{user_question}"')
         prompt_parts.append("Your response:")
@@ -398,28 +453,55 @@ async def call_gemini_for_chat_message(user_question: str, chat_history: Optiona
             return f"Error: Failed to get a response from the AI model due to an internal server issue."
 
 # --- API Endpoints ---
+UPLOAD_CHUNK_BYTES = 64 * 1024 # Uploads are read in chunks of this size
+
 @app.post("/upload-image", response_model=schemas.ImageUploadResponse)
-async def upload_image_for_ocr(file: UploadFile = File(...)):
+async def upload_image_for_ocr(
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current_user: Optional[UserModel] = Depends(auth_utils.get_current_user_optional)
+):
     """
     Accepts an image file (JPG, PNG, PDF), performs OCR, and returns the extracted text.
+    Logged-in users re-uploading an image they already bookmarked get the bookmarked text back without a new OCR call.
     """
     if not is_allowed_file(file.filename):
         logger.warning(f"Upload attempt with disallowed file type: {file.filename}")
         raise HTTPException(status_code=400, detail=f"File type not allowed. Allowed types: {config.ALLOWED_EXTENSIONS}")
 
-    temp_file_path = os.path.join(config.UPLOAD_FOLDER, file.filename)
+    if file.size is not None and file.size > config.IMAGE_MAX_FILE_BYTES:
+        logger.warning(f"Upload rejected, file too large: {file.filename} ({file.size} bytes)")
+        raise HTTPException(status_code=413, detail=f"Image too large. Maximum size is {config.IMAGE_MAX_FILE_BYTES} bytes.")
+
     logger.info(f"Receiving file: {file.filename}")
 
     try:
-        # Save the uploaded file temporarily
-        with open(temp_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        logger.info(f"File saved temporarily to: {temp_file_path}")
+        # Read the upload in chunks, hashing as we go; OCR works on the bytes in memory
+        hasher = ocr.new_image_hasher()
+        contents = bytearray()
+        while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+            if len(contents) + len(chunk) > config.IMAGE_MAX_FILE_BYTES: # file.size isn't always known up front
+                raise HTTPException(status_code=413, detail=f"Image too large. Maximum size is {config.IMAGE_MAX_FILE_BYTES} bytes.")
+            hasher.update(chunk)
+            contents += chunk
+        image_hash = hasher.hexdigest()
+
+        if config.DEBUG_SAVE_UPLOADS:
+            saved_path = os.path.join(config.UPLOAD_FOLDER, f"{image_hash}_{os.path.basename(file.filename)}")
+            async with aiofiles.open(saved_path, "wb") as buffer:
+                await buffer.write(contents)
+            logger.info(f"Upload saved for debugging to: {saved_path}")
 
         # Perform OCR
-        extracted_text = await ocr.extract_text_from_image(temp_file_path)
+        extracted_text = await ocr.extract_text_from_image_bytes(
+            bytes(contents),
+            file.filename,
+            db=db,
+            user_id=current_user.id if current_user else None,
+            image_hash=image_hash
+        )
         logger.info(f"OCR successful for {file.filename}. Text: {extracted_text[:50]}...")
-        return schemas.ImageUploadResponse(status="success", extracted_text=extracted_text)
+        return schemas.ImageUploadResponse(status="success", extracted_text=extracted_text, image_hash=image_hash)
 
     except HTTPException as e:
         # Re-raise HTTP exceptions from OCR module
@@ -430,17 +512,10 @@ async def upload_image_for_ocr(file: UploadFile = File(...)):
         # Return a generic error response
         return schemas.ImageUploadResponse(status="error", error=f"Failed to process image: {str(e)}")
     finally:
-        # Clean up the temporary file
-        if os.path.exists(temp_file_path):
-            try:
-                os.remove(temp_file_path)
-                logger.info(f"Temporary file deleted: {temp_file_path}")
-            except Exception as e:
-                logger.error(f"Error deleting temporary file {temp_file_path}: {e}")
         # Close the file handle explicitly
         await file.close()
 
-@app.post("/solve-text", response_model=schemas.SolutionResponse)
+@app.post("/solve-text", response_model=schemas.SolutionResponse, response_model_exclude_none=True)
 async def solve_math_from_text(request: schemas.SolveTextRequest, db: Session = Depends(get_db), current_user: UserModel = Depends(get_current_user)):
     """
     Accepts math problem text, solves it, and returns the solution, steps, and explanation.
@@ -476,28 +551,7 @@ async def solve_math_from_text(request: schemas.SolveTextRequest, db: Session =
                 updated_xp=updated_xp_value
             )
 
-        formatted_steps: List[schemas.Step] = []
-        raw_steps = solver_result.get("steps")
-        if raw_steps and isinstance(raw_steps, list):
-            for i, step_text in enumerate(raw_steps):
-                if isinstance(step_text, str):
-                    formatted_steps.append(schemas.Step(step_number=i + 1, explanation=step_text))
-        
-        final_answer_str: Optional[str] = None
-        raw_solution = solver_result.get("solution")
-        if raw_solution:
-             if isinstance(raw_solution, list):
-                 final_answer_str = ", ".join(map(str, raw_solution))
-             else:
-                  final_answer_str = str(raw_solution)
-
-        return schemas.SolutionResponse(
-            original_problem=question,
-            steps=formatted_steps,
-            final_answer=final_answer_str,
-            error=None,
-            updated_xp=updated_xp_value
-        )
+        return _format_solution_response(question, solver_result, updated_xp=updated_xp_value)
     except HTTPException as e:
         logger.error(f"HTTPException during solving '{question}' for user {current_user.email}: {e.detail}")
         raise e
@@ -520,14 +574,58 @@ async def get_text_to_speech(text: str = Query(..., min_length=1)):
         raise HTTPException(status_code=400, detail="No text provided for TTS.")
 
     try:
-        audio_stream = await speech.text_to_speech(text)
+        audio = await speech.text_to_speech(text)
         logger.info(f"Generated speech for: {text[:50]}...")
-        return StreamingResponse(audio_stream, media_type="audio/mpeg")
+        # The clip is already in memory: send it in one body instead of streaming a BytesIO
+        # (which StreamingResponse would iterate line by line through the thread pool)
+        return Response(content=audio, media_type=speech.AUDIO_MEDIA_TYPE)
     except Exception as e:
         logger.error(f"Error generating speech for '{text[:50]}...': {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to generate speech: {str(e)}")
 
-@app.post("/generate-solution", response_model=schemas.SolutionResponse)
+# Solutions and graphs can change once the caches expire, so clients may store them but must revalidate
+SOLUTION_CACHE_CONTROL = "private, no-cache"
+
+def _etag_response(content: Dict[str, Any]) -> Response:
+    """Serializes `content` once and tags it with an ETag (hash of that JSON).
+
+    The response is returned as-is, so response_model validation/serialization is skipped (graphs carry ~100 KB of base64).
+    These routes are POSTs, so If-None-Match isn't honoured (RFC 9110 only allows 304 for GET/HEAD).
+    """
+    body = orjson.dumps(content)
+    headers = {"ETag": f'"{hashlib.sha256(body).hexdigest()}"', "Cache-Control": SOLUTION_CACHE_CONTROL}
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def _format_solution_response(
+    problem_text: str, solver_result: Dict[str, Any], updated_xp: Optional[int] = None
+) -> schemas.SolutionResponse:
+    """Adapts a solver result (Dict[str, Any]) to the SolutionResponse model."""
+    formatted_steps: List[schemas.Step] = []
+    raw_steps = solver_result.get("steps")
+    if raw_steps and isinstance(raw_steps, list):
+        for i, step_text in enumerate(raw_steps):
+            if isinstance(step_text, str):
+                formatted_steps.append(schemas.Step(step_number=i + 1, explanation=step_text))
+
+    final_answer_str: Optional[str] = None
+    if solver_result.get("solution"):
+         # Join list of solutions into a single string if needed
+         if isinstance(solver_result["solution"], list):
+             final_answer_str = ", ".join(map(str, solver_result["solution"]))
+         else:
+              final_answer_str = str(solver_result["solution"])
+
+    # Note: solver_result["explanation"] is ignored as SolutionResponse doesn't have a field for it
+
+    return schemas.SolutionResponse(
+        original_problem=problem_text, 
+        steps=formatted_steps, 
+        final_answer=final_answer_str,
+        error=None, # Explicitly set error to None on success
+        updated_xp=updated_xp
+    )
+
+@app.post("/generate-solution", response_model=schemas.SolutionResponse, response_model_exclude_none=True)
 async def generate_solution(request: schemas.ProblemRequest):
     """
     Receives a problem, asks the solver module for a solution/steps/explanation,
@@ -545,28 +643,8 @@ async def generate_solution(request: schemas.ProblemRequest):
              # Return error in the expected SolutionResponse format
              return schemas.SolutionResponse(original_problem=request.problem_text, steps=[], error=solver_result["error"])
 
-        # Adapt the solver result (Dict[str, Any]) to the SolutionResponse model
-        formatted_steps: List[schemas.Step] = []
-        if solver_result.get("steps"):
-            for i, step_text in enumerate(solver_result["steps"]):
-                formatted_steps.append(schemas.Step(step_number=i + 1, explanation=step_text))
-        
-        final_answer_str: Optional[str] = None
-        if solver_result.get("solution"):
-             # Join list of solutions into a single string if needed
-             if isinstance(solver_result["solution"], list):
-                 final_answer_str = ", ".join(map(str, solver_result["solution"]))
-             else:
-                  final_answer_str = str(solver_result["solution"])
-
-        # Note: solver_result["explanation"] is ignored as SolutionResponse doesn't have a field for it
-
-        return schemas.SolutionResponse(
-            original_problem=request.problem_text, 
-            steps=formatted_steps, 
-            final_answer=final_answer_str,
-            error=None # Explicitly set error to None on success
-        )
+        solution = _format_solution_response(request.problem_text, solver_result)
+        return _etag_response(solution.model_dump(mode="json", exclude_none=True))
 
     except HTTPException as e:
         # Re-raise HTTP exceptions (e.g., from solver config issues)
@@ -630,7 +708,7 @@ async def explain_step(request: schemas.ExplanationRequest, db: Session = Depend
         )
 
     except Exception as e:
-        print(f"Error explaining step: {e}")
+        logger.error(f"Error explaining step: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to get explanation due to an internal error.")
 
 # ---> ADD Drawing Recognition Endpoint <---
@@ -662,7 +740,7 @@ async def recognize_drawing(request: schemas.DrawingRequest):
 # ---> END ADDITION <---
 
 # ---> ADD Practice Problem Endpoint <---
-@app.post("/generate-practice-problem", response_model=schemas.PracticeResponse)
+@app.post("/generate-practice-problem", response_model=schemas.PracticeResponse, response_model_exclude_none=True)
 async def generate_practice_problem(request: schemas.PracticeRequest, db: Session = Depends(get_db), current_user: UserModel = Depends(get_current_user)):
     """
     Receives a topic (and optionally a previous problem), asks Gemini 
@@ -708,14 +786,54 @@ async def generate_practice_problem(request: schemas.PracticeRequest, db: Sessio
 # ---> END ADDITION <---
 
 # ---> ADD Graph Generation Endpoint <---
-@app.post("/generate-graph", response_model=schemas.GraphResponse)
+GRAPH_CACHE_MAXSIZE = 512 # Rendered graphs kept in this process (x^2, sin(x), ... are requested over and over)
+_graph_cache: LRUCache = LRUCache(maxsize=GRAPH_CACHE_MAXSIZE) # Normalized equation -> data URL
+# Rendering is CPU-bound (sympy + matplotlib), so it runs in worker processes instead of threads that
+# would serialize on the GIL. The cores are split between the uvicorn workers (WEB_CONCURRENCY).
+GRAPH_MAX_WORKERS = max(1, (os.cpu_count() or 1) // config.WEB_CONCURRENCY)
+_graph_executor: Optional[ProcessPoolExecutor] = None # Created in lifespan
+
+def _new_graph_executor() -> ProcessPoolExecutor:
+    """Process pool for graph rendering. Never forks the server process itself (it runs the event loop, the
+    logging listener and client threads): workers come from a forkserver (spawn where unavailable)."""
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context("forkserver")
+        mp_context.set_forkserver_preload(["backend.graphing"]) # Import matplotlib once in the fork server
+    else:
+        mp_context = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(max_workers=GRAPH_MAX_WORKERS, mp_context=mp_context)
+_GRAPH_FUNCTION_RE = re.compile(r"\b(sin|cos|tan|cot|sec|csc|log|ln|exp|sqrt|abs)\b", re.IGNORECASE)
+
+def _normalize_equation(equation: str) -> str:
+    """Collapses whitespace and lowercases function names so "Sin( x )" and "sin( x )" share a cache entry."""
+    return _GRAPH_FUNCTION_RE.sub(lambda m: m.group().lower(), " ".join(equation.split()))
+
+@app.post("/generate-graph", response_model=schemas.GraphResponse, response_model_exclude_none=True)
 async def generate_graph_endpoint(request: schemas.GraphRequest):
     logger.info(f"Received graph generation request for equation: {request.equation}")
+    equation = _normalize_equation(request.equation)
+    cached_url = _graph_cache.get(equation)
+    if cached_url:
+        return _etag_response({"image_data_url": cached_url})
     try:
-        # Call the synchronous function in a thread pool
-        image_data_url = await run_in_threadpool(graphing.generate_graph, request.equation)
+        # Rendering is deterministic, so graphs are also cached across workers
+        cache_key = cache.content_key("graph", equation)
+        cached_url = await cache.get_json(cache_key)
+        if cached_url:
+            _graph_cache[equation] = cached_url
+            return _etag_response({"image_data_url": cached_url})
+
+        # Render in the process pool; graphing sets the Agg backend at import, including in the workers
+        async def render_and_store():
+            # Outside the app lifespan (no pool) this falls back to the default thread pool
+            image_data_url = await asyncio.get_running_loop().run_in_executor(_graph_executor, graphing.generate_graph, equation)
+            if image_data_url:
+                _graph_cache[equation] = image_data_url
+                await cache.set_json(cache_key, image_data_url, cache.GRAPH_CACHE_TTL_SECONDS)
+            return image_data_url
+        image_data_url = await single_flight(cache_key, render_and_store) # Concurrent requests for one equation render it once
         if image_data_url:
-            return schemas.GraphResponse(image_data_url=image_data_url)
+            return _etag_response({"image_data_url": image_data_url})
         else:
             # This case should ideally be handled by an exception in generate_graph_image
             logger.error("Graph generation returned no data and no exception.")
@@ -754,6 +872,56 @@ async def diagnose_solution_endpoint(request: schemas.DiagnoseSolutionRequest):
         raise HTTPException(status_code=500, detail=f"Failed to diagnose solution: {str(e)}")
 # ---> END ADDITION <---
 
+# ---> ADD Streaming Endpoints (Server-Sent Events) <---
+@app.post("/generate-solution-stream")
+async def generate_solution_stream(request: schemas.ProblemRequest):
+    """
+    Streams the solver's response as Server-Sent Events: "data" events with the text as Gemini
+    writes it, then a "result" event with the parsed SolutionResponse.
+    """
+    if not request.problem_text.strip():
+        raise HTTPException(status_code=400, detail="Problem text cannot be empty.")
+    if not solver.is_configured():
+        raise HTTPException(status_code=501, detail="Math solving via AI model is not configured on the server.")
+
+    # Started before the response, so a busy upstream (503) or a refused request is a real HTTP error
+    updates = await prime_stream(solver.stream_math_solution(request.problem_text))
+
+    async def events():
+        try:
+            async for update in updates:
+                if "result" in update:
+                    solution = _format_solution_response(request.problem_text, update["result"])
+                    yield sse_event(solution.model_dump(), event="result")
+                else:
+                    yield sse_event(update)
+        except Exception as e:
+            logger.error(f"Streaming solution failed for '{request.problem_text[:60]}': {e}", exc_info=True)
+            yield sse_error(e)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.post("/diagnose-solution-stream")
+async def diagnose_solution_stream(request: schemas.DiagnoseSolutionRequest):
+    """Streams the mistake-diagnosis feedback as Server-Sent Events, ending with a "done" (or "error") event."""
+    if not solver.is_configured():
+        raise HTTPException(status_code=501, detail="Mistake diagnosis via AI model is not configured on the server.")
+
+    # Started before the response, so a busy upstream (503) or a refused request is a real HTTP error
+    texts = await prime_stream(solver.stream_diagnosis(request.problem_text, request.user_steps))
+
+    async def events():
+        try:
+            async for text in texts:
+                yield sse_event({"text": text})
+            yield sse_event({}, event="done")
+        except Exception as e:
+            logger.error(f"Streaming diagnosis failed for '{request.problem_text[:60]}': {e}", exc_info=True)
+            yield sse_error(e)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+# ---> END ADDITION <---
+
 # ---> ADD User Registration Endpoint <---
 @app.post("/api/register", response_model=schemas.RegistrationResponse, status_code=201)
 async def register_user(request: schemas.UserRegistrationRequest, db: Session = Depends(get_db)):
@@ -1015,4 +1183,14 @@ if __name__ == "__main__":
     import uvicorn
     logger.info("Starting Math Wiz Assistant API with Uvicorn")
     # Note: CORS origins might need adjustment if running differently than standard dev server
-    uvicorn.run(app, host="127.0.0.1", port=8000, log_level="info") 
\ No newline at end of file
+    # Workers need an import string rather than the app object.
+    # "auto" picks uvloop and httptools (installed with uvicorn[standard]) and falls back to asyncio on Windows.
+    uvicorn.run(
+        "backend.main:app",
+        host="127.0.0.1",
+        port=8000,
+        workers=config.WEB_CONCURRENCY,
+        loop="auto",
+        http="auto",
+        log_level="info",
+    )
\ No newline at end of file
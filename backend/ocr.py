@@ -1,6 +1,13 @@
 """Optical Character Recognition (OCR) Utilities"""
+import asyncio
+import aiofiles
+import aiofiles.os
 import logging
+import hashlib
+from typing import Optional
 from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
 from PIL import Image
 # Remove pytesseract and related imports if sticking purely to Gemini
 # import pytesseract 
@@ -8,10 +15,25 @@ from PIL import Image
 # import numpy as np
 # from pdf2image import convert_from_path
 from . import config # Relative import
+from . import crud
+from . import cache
+from .ai_cache import single_flight
+from .limiter import ocr_limiter
 import io # For handling byte streams
+import os
 
 logger = logging.getLogger(__name__)
 
+# Extension -> MIME type for the formats the OCR path understands
+_MIME_TABLE = {
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "mpo": "image/jpeg", # Pillow's format for multi-picture JPEGs (most phone cameras); Image.MIME lacks it or says image/mpo
+    "webp": "image/webp",
+    "pdf": "application/pdf",
+}
+
 # --- Optional: Google Generative AI (Gemini) --- 
 # Attempt to import and configure Gemini
 genai = None
@@ -28,6 +50,9 @@ except ImportError:
 except Exception as e:
     logger.error(f"Error configuring Google Generative AI for OCR: {e}")
 
+# Shared vision model instance; created once instead of per request
+_GEMINI_MODEL = genai.GenerativeModel('gemini-1.5-flash-latest') if genai else None
+
 # --- Gemini OCR Helper --- 
 async def extract_text_with_gemini(image_path_or_bytes: str | bytes, mime_type: str) -> str:
     """Extracts text from image bytes using Gemini Pro Vision API."""
@@ -36,7 +61,7 @@ async def extract_text_with_gemini(image_path_or_bytes: str | bytes, mime_type:
 
     logger.info(f"Attempting OCR with Gemini for mime_type: {mime_type}")
     # Use a model compatible with vision
-    model = genai.GenerativeModel('gemini-1.5-flash-latest') 
+    model = _GEMINI_MODEL
 
     # Prompt for Gemini
     prompt = "Extract all text content accurately from this image. Preserve the original formatting and line breaks where possible. Focus on mathematical notation if present."
@@ -50,7 +75,7 @@ async def extract_text_with_gemini(image_path_or_bytes: str | bytes, mime_type:
 
     try:
         # Generate content
-        response = await model.generate_content_async([prompt] + image_parts)
+        response = await ocr_limiter.run(lambda: model.generate_content_async([prompt] + image_parts)) # Bounded upstream concurrency
 
         # Extract text - handle potential response structures/errors
         if response and hasattr(response, 'text'):
@@ -90,37 +115,118 @@ async def extract_text_with_gemini(image_path_or_bytes: str | bytes, mime_type:
             # Generic internal error for other exceptions
             raise HTTPException(status_code=500, detail=f"Gemini OCR failed: An unexpected error occurred.")
 
-# --- Main OCR Extraction Function --- 
-async def extract_text_from_image(file_path: str) -> str:
-    """Extracts text using Gemini. Reads file content into memory."""
-    logger.info(f"Extracting text from: {file_path}")
-    file_extension = file_path.rsplit('.', 1)[1].lower()
-    mime_type = f'image/{file_extension}' if file_extension != 'jpg' else 'image/jpeg'
-    
+def _sniff_image_mime_type(image_bytes: bytes, filename: str) -> str:
+    """Returns the MIME type detected from the image header, or raises 415 if it isn't a supported image."""
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            sniffed = _MIME_TABLE.get((img.format or "").lower()) or Image.MIME.get(img.format)
+    except Exception: # Pillow raises UnidentifiedImageError (and others) for non-images
+        sniffed = None
+    if sniffed not in _MIME_TABLE.values():
+        logger.error(f"Uploaded file content is not a supported image: {filename} (detected: {sniffed})")
+        raise HTTPException(status_code=415, detail="File content is not a supported image. Use PNG, JPG, JPEG, or WEBP.")
+    return sniffed
+
+def new_image_hasher():
+    """Incremental form of compute_image_hash (update() chunk by chunk, then hexdigest())."""
+    return hashlib.blake2b(digest_size=16)
+
+def compute_image_hash(image_bytes: bytes) -> str:
+    """Content hash used to recognise re-uploads of the same image."""
+    hasher = new_image_hasher()
+    hasher.update(image_bytes)
+    return hasher.hexdigest()
+
+async def _lookup_bookmark(db: Session, user_id: int, image_hash: str):
+    try:
+        return await run_in_threadpool(crud.get_bookmark_by_image_hash, db, user_id=user_id, image_hash=image_hash)
+    except Exception as e: # A failed lookup only costs us the shortcut
+        logger.warning(f"Bookmark lookup by image hash failed: {e}")
+        return None
+
+async def _no_bookmark():
+    return None
+
+# --- Main OCR Extraction Functions --- 
+async def extract_text_from_image_bytes(
+    image_bytes: bytes,
+    filename: str,
+    db: Optional[Session] = None,
+    user_id: Optional[int] = None,
+    image_hash: Optional[str] = None,
+) -> str:
+    """Extracts text from an in-memory image using Gemini. `filename` is only used for its extension.
+
+    If a DB session and user are given, an image the user has already bookmarked
+    (matched by metadata_json["image_hash"]) is answered from the bookmark instead of Gemini.
+    """
+    logger.info(f"Extracting text from: {filename}")
+    file_extension = os.path.splitext(filename)[1].lstrip('.').lower()
+    mime_type = _MIME_TABLE.get(file_extension)
+
+    if mime_type is None: # Also covers files without an extension
+         logger.error(f"Unsupported file type for Gemini OCR: {file_extension}")
+         raise HTTPException(status_code=400, detail=f"Unsupported file type for OCR: {file_extension}. Use PNG, JPG, JPEG, or WEBP.")
+
     # Handle PDF separately - for now, let's raise an error as Gemini doesn't directly take PDF bytes
     # A better implementation would convert PDF pages to images first
     if file_extension == 'pdf':
          logger.error("Direct PDF processing with Gemini OCR is not implemented in this version.")
          # TODO: Implement PDF to image conversion here if needed
          raise HTTPException(status_code=501, detail="PDF processing not implemented for this OCR method.")
-    
-    if file_extension not in ['png', 'jpg', 'jpeg', 'webp']: # Gemini Vision supports these
-         logger.error(f"Unsupported file type for Gemini OCR: {file_extension}")
-         raise HTTPException(status_code=400, detail=f"Unsupported file type for OCR: {file_extension}. Use PNG, JPG, JPEG, or WEBP.")
 
     try:
-        # Read the image file bytes
-        with open(file_path, "rb") as f:
-            image_bytes = f.read()
-        
-        # Call the Gemini helper
-        return await extract_text_with_gemini(image_bytes, mime_type)
+        if len(image_bytes) > config.IMAGE_MAX_FILE_BYTES:
+            logger.error(f"Image too large for OCR: {len(image_bytes)} bytes (limit {config.IMAGE_MAX_FILE_BYTES})")
+            raise HTTPException(status_code=413, detail=f"Image too large. Maximum size is {config.IMAGE_MAX_FILE_BYTES} bytes.")
+
+        # Trust the file content, not its extension (Pillow only parses the header here)
+        mime_type = _sniff_image_mime_type(image_bytes, filename)
+
+        image_hash = image_hash or compute_image_hash(image_bytes)
+        cache_key = f"ocr:{image_hash}"
+
+        # The user's bookmark (DB, in a worker thread) and the shared cache are looked up concurrently
+        bookmark_lookup = _lookup_bookmark(db, user_id, image_hash) if db is not None and user_id is not None else _no_bookmark()
+        existing, cached_text = await asyncio.gather(bookmark_lookup, cache.get_json(cache_key))
+        if existing:
+            logger.info(f"OCR skipped: image hash {image_hash} matches bookmark {existing.id}")
+            return existing.question_text
+
+        # Same image OCR'd before (by anyone)? Bookmarked text is user-edited, so only Gemini output is shared.
+        if cached_text is not None:
+            logger.info(f"OCR cache hit for image hash {image_hash}")
+            return cached_text
+
+        # Call the Gemini helper; concurrent uploads of the same image share one call
+        async def ocr_and_store():
+            extracted_text = await extract_text_with_gemini(image_bytes, mime_type)
+            await cache.set_json(cache_key, extracted_text, cache.OCR_CACHE_TTL_SECONDS)
+            return extracted_text
+        return await single_flight(cache_key, ocr_and_store)
 
-    except FileNotFoundError:
-        logger.error(f"Image file not found at path: {file_path}")
-        raise HTTPException(status_code=404, detail="Image file not found for OCR processing.")
     except HTTPException as e:
          raise e # Re-raise HTTP exceptions from Gemini helper
     except Exception as e:
-        logger.error(f"An unexpected error occurred reading file or calling OCR for {file_path}: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"An unexpected error occurred during OCR processing: {str(e)}") 
\ No newline at end of file
+        logger.error(f"An unexpected error occurred calling OCR for {filename}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred during OCR processing: {str(e)}")
+
+async def extract_text_from_image(
+    file_path: str,
+    db: Optional[Session] = None,
+    user_id: Optional[int] = None,
+    image_hash: Optional[str] = None,
+) -> str:
+    """Like extract_text_from_image_bytes, for an image on disk."""
+    try:
+        # Reject oversized files before reading them into memory
+        file_size = await aiofiles.os.path.getsize(file_path)
+        if file_size > config.IMAGE_MAX_FILE_BYTES:
+            logger.error(f"Image too large for OCR: {file_size} bytes (limit {config.IMAGE_MAX_FILE_BYTES})")
+            raise HTTPException(status_code=413, detail=f"Image too large. Maximum size is {config.IMAGE_MAX_FILE_BYTES} bytes.")
+        async with aiofiles.open(file_path, "rb") as f: # Disk I/O off the event loop
+            image_bytes = await f.read()
+    except FileNotFoundError:
+        logger.error(f"Image file not found at path: {file_path}")
+        raise HTTPException(status_code=404, detail="Image file not found for OCR processing.")
+    return await extract_text_from_image_bytes(image_bytes, file_path, db=db, user_id=user_id, image_hash=image_hash)
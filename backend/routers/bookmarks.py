@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import ORJSONResponse # Faster serialization for metadata_json blobs and datetimes
 from sqlalchemy.orm import Session
 from typing import List
 
@@ -9,7 +10,8 @@ from ..auth_utils import get_current_user # Assuming get_current_user is in auth
 router = APIRouter(
     prefix="/api/bookmarks",
     tags=["bookmarks"],
-    dependencies=[Depends(get_current_user)] # All routes in this router will require authentication
+    dependencies=[Depends(get_current_user)], # All routes in this router will require authentication
+    default_response_class=ORJSONResponse
 )
 
 @router.post("/", response_model=schemas.BookmarkResponse, status_code=status.HTTP_201_CREATED)
@@ -1,10 +1,14 @@
 # backend/routers/cs_router.py
 from fastapi import APIRouter, HTTPException, Depends
-from typing import List, Union, Optional # Added Optional
+from fastapi.responses import StreamingResponse
+from typing import Dict, List, Union, Optional # Added Optional
 import random
 import re # For parsing AI responses
 import logging # Added logging
 import asyncio # Added asyncio
+import functools
+import uuid
+from cachetools import TTLCache
 
 # Explicitly configure logger for this module
 logger = logging.getLogger(__name__)
@@ -18,26 +22,117 @@ logger.setLevel(logging.INFO) # Ensure level is INFO for this logger
 # Import the schemas (adjust path if structure differs)
 # Assuming schemas.py is in the parent directory (backend/)
 from .. import schemas 
+from .. import ai_utils
+from ..sse import sse_event, sse_error
+from ..ai_cache import cached_response, make_cache_key, question_pool, response_cache, QUESTION_POOL_LOW_WATER
 
 # --- AI Client Setup ---
-# Attempt to import and configure Gemini (similar to main.py)
-# Ideally, move this configuration to a central place (e.g., config.py or ai_utils.py)
-# and import the configured 'genai' object.
-genai = None
-try:
-    import google.generativeai as genai_import
-    # Assuming config is accessible, e.g., by importing from .. import config
-    from .. import config as backend_config
-    if backend_config.GOOGLE_API_KEY:
-        genai_import.configure(api_key=backend_config.GOOGLE_API_KEY)
-        genai = genai_import
-        logger.info("Google Generative AI configured successfully for cs_router.")
-    else:
-        logger.warning("Google API Key not found in config/env. CS AI features might be disabled.")
-except ImportError:
-    logger.warning("google-generativeai package not installed. CS AI features disabled.")
-except Exception as e:
-    logger.error(f"Error configuring Google Generative AI in cs_router: {e}")
+# Gemini is called over REST through the shared async HTTP client in ai_utils
+if not ai_utils.is_configured():
+    logger.warning("Google API Key not found in config/env. CS AI features might be disabled.")
+
+def require_ai(fn):
+    """Makes an async AI function fail fast with a 500 when no API key is configured.
+
+    The key is read from the environment at import time, so this is decided once when the module loads.
+    """
+    if ai_utils.is_configured():
+        return fn
+
+    @functools.wraps(fn)
+    async def not_configured(*args, **kwargs):
+        raise HTTPException(status_code=500, detail="AI Service not configured.")
+    return not_configured
+
+@functools.lru_cache(maxsize=256)
+def _normalize_chapter(name: str) -> str:
+    """Cache-key form of a chapter name, so "Data Structures " and "data structures" share cached AI output."""
+    return " ".join(name.split()).lower()
+
+def _chapter_cache_args(chapter: str) -> List[str]:
+    return [_normalize_chapter(chapter)]
+
+# --- Static Prompt Fragments ---
+# Per-type instructions appended to the question generation prompt
+_QUESTION_PROMPT_SUFFIXES = {
+    "mcq": """
+        Provide the following:
+        1. The question text.
+        2. 3-4 multiple-choice options, clearly labeled (e.g., A, B, C, D or 1, 2, 3, 4).
+        3. Indicate the correct answer clearly (e.g., "Correct Answer: B").
+        Format:
+        Question: [Question text]
+        Option A: [Option A text]
+        Option B: [Option B text]
+        Option C: [Option C text]
+        Correct Answer: [Correct Letter/Number]
+        """,
+    "coding": """
+        Provide the following:
+        1. A clear description of the coding problem (assume Python unless specified otherwise).
+        2. An optional simple starting code stub (e.g., function definition with 'pass').
+        Format:
+        Problem: [Problem description]
+        Code Stub: (Optional)
+        [Code stub here]
+        """,
+    "theory": """
+        Provide a clear theory or conceptual question.
+        Format:
+        Question: [Question text]
+        """,
+}
+
+# Instructions closing the MCQ evaluation prompt ("{answer}" is replaced with the selected option ID)
+_MCQ_EVALUATION_INSTRUCTIONS = """Please perform the following:
+1.  Identify the ID of the *correct* option from the "Available Options" list.
+2.  Provide the text of the correct option.
+3.  Determine if the student's selected option (ID: {answer}) is correct.
+4.  Provide a concise explanation for why the correct option is indeed correct.
+5.  If the student's answer was incorrect, briefly explain the flaw in their choice or why the chosen option is wrong.
+
+Format your response STRICTLY as follows, ensuring each field is on a new line:
+Correctness: [Yes/No based on student's answer]
+CorrectOptionID: [ID of the correct option]
+CorrectOptionText: [Text of the correct option]
+Explanation: [Your explanation of why the correct option is correct, and feedback on student's choice if incorrect]
+AI_Feedback: [Any brief, general feedback or encouragement for the student, or a more detailed look if the explanation is simple]
+DetailedSolution: [Restate the correct option and a clear, comprehensive reason why it is the best answer among the choices. This can be similar to or expand on the Explanation.]
+"""
+
+# Instructions closing the explanation prompt for an MCQ already graded from its stored answer key
+_MCQ_EXPLANATION_INSTRUCTIONS = """Please provide:
+1.  A concise explanation for why the correct option is indeed correct.
+2.  If the student's answer was incorrect, briefly explain the flaw in their choice or why the chosen option is wrong.
+
+Format your response STRICTLY as follows, ensuring each field is on a new line:
+Explanation: [Your explanation of why the correct option is correct, and feedback on student's choice if incorrect]
+AI_Feedback: [Any brief, general feedback or encouragement for the student, or a more detailed look if the explanation is simple]
+DetailedSolution: [Restate the correct option and a clear, comprehensive reason why it is the best answer among the choices. This can be similar to or expand on the Explanation.]
+"""
+
+# Per-type instructions appended to the coding/theory evaluation prompt
+_EVALUATION_PROMPT_SUFFIXES = {
+    "coding": """
+        Please evaluate the student's Python code. Assess the following:
+        1. Correctness: Does the code likely solve the problem based on the description? (Answer Yes/No/Partially)
+        2. Explanation: Briefly explain if the code is correct, or why it's incorrect or incomplete.
+        3. AI Feedback: Provide specific, constructive feedback on the code's logic, style, potential bugs, or areas for improvement.
+        4. Detailed Solution: Provide a correct and idiomatic Python solution to the original problem.
+        5. Simulated Output: Describe the expected output for a simple test case (e.g., "Calling add(2, 3) should return 5"). Do NOT attempt to execute the code.
+        
+        Format your response clearly, label each section (Correctness, Explanation, AI Feedback, Detailed Solution, Simulated Output).
+        """,
+    "theory": """
+        Please evaluate the student's explanation. Assess the following:
+        1. Correctness: Is the explanation conceptually accurate and complete? (Answer Yes/No/Partially)
+        2. Explanation: Briefly explain why the student's answer is correct or where it falls short.
+        3. AI Feedback: Provide specific feedback on clarity, accuracy, depth, and examples used. Suggest improvements.
+        4. Detailed Solution: Provide a clear, concise, and accurate model answer to the original question.
+        
+        Format your response clearly, label each section (Correctness, Explanation, AI Feedback, Detailed Solution).
+        """,
+}
 
 # --- Router Setup ---
 router = APIRouter(
@@ -45,135 +140,272 @@ router = APIRouter(
     tags=["Computer Science"], # For API documentation
 )
 
+# --- Precompiled Patterns for Parsing AI Responses ---
+_RE_FLAGS = re.DOTALL | re.IGNORECASE
+
+# Question generation
+_MCQ_QUESTION_RE = re.compile(r"Question:\s*(.*?)\s*(?:Option A:|Option 1:|$)", _RE_FLAGS)
+# Start of an option: "Option A: text", "B) text", "3. text" -- matched per line, so it's linear (no lookahead backtracking)
+_OPTION_LINE_RE = re.compile(r"(?:Option\s+)?([A-D1-4])[:.)]\s*(.*)", re.IGNORECASE)
+_MCQ_CORRECT_KEY_RE = re.compile(r"Correct Answer:?\s*([A-D]|[1-4])", re.IGNORECASE)
+_CODING_PROBLEM_RE = re.compile(r"Problem:\s*(.*?)\s*(?:Code Stub:|$)", _RE_FLAGS)
+_CODING_STUB_RE = re.compile(r"Code Stub:\s*(.*)", _RE_FLAGS)
+_THEORY_QUESTION_RE = re.compile(r"Question:\s*(.*)", _RE_FLAGS)
+
+# Coding/theory evaluation
+_EVAL_CORRECTNESS_RE = re.compile(r"Correctness:\s*(Yes|No|Partially)", re.IGNORECASE)
+_EVAL_EXPLANATION_RE = re.compile(r"Explanation:\s*(.*?)\s*(?:AI Feedback:|$)", _RE_FLAGS)
+_EVAL_AI_FEEDBACK_RE = re.compile(r"AI Feedback:\s*(.*?)\s*(?:Detailed Solution:|$)", _RE_FLAGS)
+_EVAL_DETAILED_SOLUTION_RE = re.compile(r"Detailed Solution:\s*(.*?)\s*(?:Simulated Output:|$)", _RE_FLAGS)
+_EVAL_SIMULATED_OUTPUT_RE = re.compile(r"Simulated Output:\s*(.*)", _RE_FLAGS)
+
+# Flashcards: blocks starting with Q:/Question: and A:/Answer:, up to the next Q:/Question: or end of string
+_FLASHCARD_RE = re.compile(r"(?:Q:|Question:)\s*(.*?)\s*(?:A:|Answer:)\s*(.*?)(?=\s*(?:Q:|Question:)|$)", _RE_FLAGS)
+
+# Key points returned when none can be parsed from the AI response
+_UNPARSED_KEY_POINTS_FALLBACK = ("Could not parse key points from AI response. Please try again.",)
+
+# Chapter aids: section markers (on their own line) in the batched flashcards/summary/key points response
+_CHAPTER_AIDS_SECTION_RE = re.compile(r"^\s*===\s*(FLASHCARDS|SUMMARY|KEY_POINTS)\s*===\s*$", re.MULTILINE | re.IGNORECASE)
+
+# --- Sanitizing AI Text ---
+# Deletes C0 control chars (except \t, \n, \r), DEL and C1 controls for str.translate; keeps ×, ÷, °, ², é, ...
+_CTRL_TRANS = {c: None for c in range(32) if c not in (9, 10, 13)} | {c: None for c in range(127, 160)}
+
+# --- Helper: Parse MCQ Evaluation Fields ---
+# Labels the MCQ evaluation prompt asks the AI to emit (lowercased) -> field name
+_MCQ_FEEDBACK_LABELS = {
+    "correctness": "correctness",
+    "correctoptionid": "correct_option_id",
+    "correctoptiontext": "correct_option_text",
+    "explanation": "explanation",
+    "ai_feedback": "ai_feedback",
+    "detailedsolution": "detailed_solution",
+}
+
+def _parse_mcq_feedback_fields(text: str) -> Dict[str, str]:
+    """Single pass over the lines: a known 'Label:' starts a field, other lines continue the current one."""
+    buffers: Dict[str, List[str]] = {}
+    current_field = None
+    for line in text.splitlines():
+        label, sep, rest = line.partition(':')
+        field = _MCQ_FEEDBACK_LABELS.get(label.strip(" *").lower()) if sep else None
+        if field:
+            current_field = field
+            buffers[field] = [rest.lstrip(" *")]
+        elif current_field:
+            buffers[current_field].append(line)
+    return {field: "\n".join(parts).strip() for field, parts in buffers.items()}
+
+# --- Generated MCQ Answer Keys ---
+# Question ID -> {"correct_id", "chapter", "question_text", "options"}, so /submit can grade MCQs without the AI
+_QUESTION_STORE: TTLCache = TTLCache(maxsize=10_000, ttl=3600)
+
 # --- Helper: Parse MCQ from AI Text ---
 def _parse_mcq_response(text: str, chapter: str, default_id: str) -> schemas.MCQQuestionResponseSchema:
     """Attempts to parse Gemini response into MCQ format."""
     try:
-        question_match = re.search(r"Question:\s*(.*?)\s*(?:Option A:|Option 1:|$)", text, re.DOTALL | re.IGNORECASE)
+        question_match = _MCQ_QUESTION_RE.search(text)
         question = question_match.group(1).strip() if question_match else "Could not parse question."
 
         options = []
-        # Refined regex: Looks for "Option [letter/digit]:" then captures text until the next "Option" or "Correct Answer"
-        option_matches = re.findall(r"(?:Option\s+([A-D]|[1-4])[:.)]|([A-D]|[1-4])[:.)])\s*(.*?)(?=\s*(?:Option\s+[A-D1-4][:.)]|Correct Answer:|$))", text, re.DOTALL | re.IGNORECASE)
-
         option_map = {'A': 'opt1', 'B': 'opt2', 'C': 'opt3', 'D': 'opt4',
                       '1': 'opt1', '2': 'opt2', '3': 'opt3', '4': 'opt4'}
 
-        for key_group1, key_group2, option_text in option_matches:
-            key = key_group1 if key_group1 else key_group2 # Use whichever group matched the letter/number
-            option_id = option_map.get(key.upper())
-            if option_id:
-                options.append(schemas.MCQOptionSchema(id=option_id, text=option_text.strip()))
+        # An option runs until the next option or the answer key; lines in between continue its text
+        option_lines: List[List[str]] = [] # [option ID, text lines...] per option
+        for line in text.splitlines():
+            stripped = line.strip()
+            if stripped.lower().startswith("correct answer"):
+                break
+            match = _OPTION_LINE_RE.fullmatch(stripped)
+            if match:
+                option_lines.append([option_map[match.group(1).upper()], match.group(2)])
+            elif option_lines and stripped:
+                option_lines[-1].append(stripped)
+        for option_id, *lines in option_lines:
+            option_text = "\n".join(part for part in lines if part)
+            if option_text:
+                options.append(schemas.MCQOptionSchema.model_construct(id=option_id, text=option_text))
 
         # Find the correct answer indicator if provided
         # Correct_Answer: B
-        correct_key_match = re.search(r"Correct Answer:?\s*([A-D]|[1-4])", text, re.IGNORECASE)
+        correct_key_match = _MCQ_CORRECT_KEY_RE.search(text)
         correct_id = None
         if correct_key_match:
              correct_id = option_map.get(correct_key_match.group(1).upper())
              # We don't return the correct ID in the question schema, it's used for evaluation
 
         if not options or len(options) < 2:
-            logger.warning(f"Could not parse options well for chapter {chapter}. Raw text: {text}")
+            logger.warning("Could not parse options well for chapter %s. Raw text: %s", chapter, text)
             # Fallback: create dummy options? Or raise error?
             options = [schemas.MCQOptionSchema(id="opt1", text="Parse Error Option 1"), schemas.MCQOptionSchema(id="opt2", text="Parse Error Option 2")]
 
-        return schemas.MCQQuestionResponseSchema(
+        elif correct_id and any(opt.id == correct_id for opt in options):
+            _QUESTION_STORE[default_id] = {
+                "correct_id": correct_id,
+                "chapter": chapter,
+                "question_text": question,
+                "options": options,
+            }
+
+        # Built from already-clean strings (options >= 2 guaranteed above), so validation is skipped
+        return schemas.MCQQuestionResponseSchema.model_construct(
             id=default_id,
             chapter=chapter,
-            question_type="mcq",
             question_text=question,
             options=options
         )
     except Exception as e:
-        logger.error(f"Error parsing MCQ response: {e}\nRaw Text: {text}", exc_info=True)
+        logger.error("Error parsing MCQ response: %s\nRaw Text: %s", e, text, exc_info=True)
         # Return a fallback error structure
         return schemas.MCQQuestionResponseSchema(
-             id=default_id, chapter=chapter, question_type="mcq",
+             id=default_id, chapter=chapter,
              question_text="Error parsing question from AI.",
              options=[schemas.MCQOptionSchema(id="err", text="Error")]
         )
 
 # --- AI Interaction Functions --- (Replacing Mocks)
 
+@require_ai
 async def generate_question_from_ai(chapter: str, question_type_filter: Optional[str] = None) -> schemas.CSQuestionResponse:
     """Calls Gemini to generate a CS practice question."""
-    if not genai:
-        raise HTTPException(status_code=500, detail="AI Service not configured.")
-
     q_type = question_type_filter if question_type_filter else random.choice(["mcq", "coding", "theory"])
-    model = genai.GenerativeModel('gemini-1.5-flash-latest')
     prompt = f"Generate a single practice question suitable for a student learning about '{chapter}' in Computer Science. The question type should be '{q_type}'.\n\n"
-    req_id = f"{q_type}_{random.randint(1000, 9999)}" # Generate ID here
+    req_id = f"{q_type}_{uuid.uuid4().hex[:12]}" # Generate ID here (unique, since MCQ answers are looked up by it)
 
-    if q_type == "mcq":
-        prompt += """
-        Provide the following:
-        1. The question text.
-        2. 3-4 multiple-choice options, clearly labeled (e.g., A, B, C, D or 1, 2, 3, 4).
-        3. Indicate the correct answer clearly (e.g., "Correct Answer: B").
-        Format:
-        Question: [Question text]
-        Option A: [Option A text]
-        Option B: [Option B text]
-        Option C: [Option C text]
-        Correct Answer: [Correct Letter/Number]
-        """
-    elif q_type == "coding":
-        prompt += """
-        Provide the following:
-        1. A clear description of the coding problem (assume Python unless specified otherwise).
-        2. An optional simple starting code stub (e.g., function definition with 'pass').
-        Format:
-        Problem: [Problem description]
-        Code Stub: (Optional)
-        [Code stub here]
-        """
-    else: # Theory
-        prompt += """
-        Provide a clear theory or conceptual question.
-        Format:
-        Question: [Question text]
-        """
+    prompt += _QUESTION_PROMPT_SUFFIXES.get(q_type, _QUESTION_PROMPT_SUFFIXES["theory"])
 
-    logger.info(f"Generating {q_type} question for {chapter}. Prompt: {prompt[:150]}...")
+    logger.info("Generating %s question for %s. Prompt: %s...", q_type, chapter, prompt[:150])
     try:
-        response = await model.generate_content_async(prompt)
+        raw_text = await ai_utils.generate(prompt)
+        logger.info("Gemini response received for %s question. Length: %d", q_type, len(raw_text))
         
-        if response and hasattr(response, 'text'):
-            raw_text = response.text
-            logger.info(f"Gemini response received for {q_type} question. Length: {len(raw_text)}")
+        if q_type == "mcq":
+            # Attempt to parse the MCQ structure
+            return _parse_mcq_response(raw_text, chapter, req_id)
+        elif q_type == "coding":
+            problem_match = _CODING_PROBLEM_RE.search(raw_text)
+            stub_match = _CODING_STUB_RE.search(raw_text)
+            problem_text = problem_match.group(1).strip() if problem_match else "Error: Could not parse problem description."
+            code_stub = stub_match.group(1).strip() if stub_match else None
+            return schemas.CodingProblemResponseSchema(
+                id=req_id, chapter=chapter,
+                question_text=problem_text, initial_code_stub=code_stub
+            )
+        else: # Theory
+            question_match = _THEORY_QUESTION_RE.search(raw_text)
+            question_text = question_match.group(1).strip() if question_match else "Error: Could not parse theory question."
+            return schemas.TheoryQuestionResponseSchema(
+                id=req_id, chapter=chapter,
+                question_text=question_text
+            )
             
-            if q_type == "mcq":
-                # Attempt to parse the MCQ structure
-                return _parse_mcq_response(raw_text, chapter, req_id)
-            elif q_type == "coding":
-                problem_match = re.search(r"Problem:\s*(.*?)\s*(?:Code Stub:|$)", raw_text, re.DOTALL | re.IGNORECASE)
-                stub_match = re.search(r"Code Stub:\s*(.*)", raw_text, re.DOTALL | re.IGNORECASE)
-                problem_text = problem_match.group(1).strip() if problem_match else "Error: Could not parse problem description."
-                code_stub = stub_match.group(1).strip() if stub_match else None
-                return schemas.CodingProblemResponseSchema(
-                    id=req_id, chapter=chapter, question_type="coding",
-                    question_text=problem_text, initial_code_stub=code_stub
-                )
-            else: # Theory
-                question_match = re.search(r"Question:\s*(.*)", raw_text, re.DOTALL | re.IGNORECASE)
-                question_text = question_match.group(1).strip() if question_match else "Error: Could not parse theory question."
-                return schemas.TheoryQuestionResponseSchema(
-                    id=req_id, chapter=chapter, question_type="theory",
-                    question_text=question_text
-                )
-                
-        elif response and hasattr(response, 'prompt_feedback') and response.prompt_feedback.block_reason:
-             raise HTTPException(status_code=500, detail=f"AI content generation blocked. Reason: {response.prompt_feedback.block_reason}")
-        else:
-             raise HTTPException(status_code=500, detail="AI model returned an unexpected or empty response.")
-
     except Exception as e:
-        logger.error(f"Gemini question generation failed for chapter '{chapter}': {e}", exc_info=True)
+        logger.error("Gemini question generation failed for chapter '%s': %s", chapter, e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"AI Generation Error: {str(e)}")
 
 
+# --- Question Prefetching ---
+QUESTION_PREFETCH_INTERVAL_SECONDS = 30
+QUESTION_RECENT_TTL_SECONDS = 300 # A key counts as in demand for this long after its last request
+# Pool key -> (chapter, q_type), expiring QUESTION_RECENT_TTL_SECONDS after the key was last requested
+_recent_question_keys: TTLCache = TTLCache(maxsize=32, ttl=QUESTION_RECENT_TTL_SECONDS)
+# Keys requested since the prefetch loop's last tick; only these are prefetched
+_requested_since_tick: Dict[str, tuple] = {}
+
+def _schedule_question_refill(key: str, chapter: str, q_type: str) -> None:
+    question_pool.schedule_refill(key, lambda: generate_question_from_ai(chapter, q_type))
+
+async def prefetch_questions_loop() -> None:
+    """Background task (started at app startup): refills pools of chapters requested since the last tick before users drain them."""
+    while True:
+        await asyncio.sleep(QUESTION_PREFETCH_INTERVAL_SECONDS)
+        requested = list(_requested_since_tick.items())
+        _requested_since_tick.clear()
+        for key, (chapter, q_type) in requested:
+            if question_pool.size(key) < QUESTION_POOL_LOW_WATER:
+                logger.debug("Prefetching %s questions for %s.", q_type, chapter)
+                _schedule_question_refill(key, chapter, q_type)
+
+async def get_pooled_question(chapter: str, question_type_filter: Optional[str] = None) -> schemas.CSQuestionResponse:
+    """Serves a pre-generated question for (chapter, type) when available, refilling the pool in the background.
+
+    Pools are only filled for repeat demand: the first request for a key is answered inline without a background refill.
+    """
+    q_type = question_type_filter if question_type_filter else random.choice(["mcq", "coding", "theory"])
+    key = make_cache_key("question", chapter=_normalize_chapter(chapter), q_type=q_type)
+    repeat_request = key in _recent_question_keys
+    _recent_question_keys[key] = (chapter, q_type) # Re-setting restarts the TTL
+    if repeat_request:
+        _requested_since_tick[key] = (chapter, q_type)
+
+    question = question_pool.pop(key)
+    if repeat_request and question_pool.size(key) < QUESTION_POOL_LOW_WATER:
+        _schedule_question_refill(key, chapter, q_type)
+    if question is not None:
+        logger.info("Serving pooled %s question for %s.", q_type, chapter)
+        return question
+
+    return await generate_question_from_ai(chapter, q_type)
+
+
+def _build_evaluation_prompt(question_type: str, question_text: str, answer: str) -> str:
+    """Prompt for evaluating a coding/theory answer (shared by /submit and /submit-stream)."""
+    if question_type not in _EVALUATION_PROMPT_SUFFIXES: # Should not happen based on request schema
+        raise HTTPException(status_code=400, detail=f"Unsupported question type for evaluation: {question_type}")
+
+    return "".join((
+        "You are an AI programming and computer science tutor evaluating a student's answer.\n\n",
+        "Question Type: ", question_type, "\n",
+        "Original Question: ", question_text, "\n",
+        "Student's Answer: ", answer, "\n\n",
+        _EVALUATION_PROMPT_SUFFIXES[question_type],
+    ))
+
+
+@cached_response("mcq_explanation", response_cache)
+async def _explain_mcq_choice(question_id: str, answer: str) -> Dict[str, str]:
+    """Asks the AI to explain a graded MCQ answer. Same question + same choice -> same explanation, so it is cached."""
+    stored = _QUESTION_STORE[question_id]
+    opt_by_id = {opt.id: opt.text for opt in stored["options"]}
+    prompt_parts = [
+        "You are an AI computer science tutor explaining the answer to a multiple-choice question.\nQuestion: ",
+        stored["question_text"],
+        "\n\nAvailable Options:\n",
+    ]
+    prompt_parts.extend(f"- Option ID: {opt.id}, Text: {opt.text}\n" for opt in stored["options"])
+    prompt_parts.append(f"\nThe correct option is {stored['correct_id']} (Text: \"{opt_by_id[stored['correct_id']]}\").\n")
+    prompt_parts.append(f"The student selected Option ID: {answer} (Text: \"{opt_by_id.get(answer, 'Not found')}\").\n\n")
+    prompt_parts.append(_MCQ_EXPLANATION_INSTRUCTIONS)
+    fields = _parse_mcq_feedback_fields((await ai_utils.generate("".join(prompt_parts))).translate(_CTRL_TRANS))
+    return {field: fields[field] for field in ("explanation", "ai_feedback", "detailed_solution") if fields.get(field)}
+
+async def _evaluate_mcq_from_store(question_id: str, stored: Dict, answer: str) -> schemas.CSSubmissionFeedbackResponse:
+    """Grades an MCQ against the answer key saved at generation time; the AI is only used for the explanation."""
+    correct_id = stored["correct_id"]
+    correct_text = next(opt.text for opt in stored["options"] if opt.id == correct_id)
+    is_correct = answer == correct_id
+    logger.info("Graded MCQ ID %s from stored answer key. Correct: %s", question_id, is_correct)
+
+    try:
+        fields = await _explain_mcq_choice(question_id, answer)
+    except Exception as e:
+        # Correctness is already known, so fall back to a plain explanation instead of failing the submission
+        logger.error("Gemini MCQ explanation failed for Q_ID %s: %s", question_id, e, exc_info=True)
+        fields = {}
+
+    default_explanation = "Correct!" if is_correct else f"Not quite. The correct answer is: {correct_text}"
+    return schemas.CSSubmissionFeedbackResponse.model_construct(
+        correct=is_correct,
+        explanation=fields.get("explanation") or default_explanation,
+        detailed_solution=fields.get("detailed_solution"),
+        ai_feedback=fields.get("ai_feedback"),
+        correct_option_id=correct_id,
+        correct_option_text=correct_text
+    )
+
+@require_ai
 async def evaluate_submission_with_ai(
     question_id: str,
     question_type: str,
@@ -182,145 +414,55 @@ async def evaluate_submission_with_ai(
     options: Optional[List[schemas.MCQOptionSchema]] = None # Added for MCQ context
 ) -> schemas.CSSubmissionFeedbackResponse:
     """Evaluates a CS submission using Gemini."""
-    if not genai:
-        raise HTTPException(status_code=500, detail="AI Service not configured.")
-        
     # --- MCQ Handling (Using AI) ---
     if question_type == "mcq":
         if not options:
-            logger.warning(f"MCQ submission for Q_ID {question_id} missing options list.")
+            logger.warning("MCQ submission for Q_ID %s missing options list.", question_id)
             raise HTTPException(status_code=400, detail="MCQ submission requires the list of options.")
 
-        user_selected_option_text = "Not found"
-        for opt in options:
-            if opt.id == answer:
-                user_selected_option_text = opt.text
-                break
-        
-        model = genai.GenerativeModel('gemini-1.5-flash-latest')
-        options_str = "\n".join([f"- Option ID: {opt.id}, Text: {opt.text}" for opt in options])
-        prompt = f"""You are an AI computer science tutor evaluating a student's answer to a multiple-choice question.
-Question: {question_text}
-
-Available Options:
-{options_str}
+        opt_by_id = {opt.id: opt.text for opt in options}
+        user_selected_option_text = opt_by_id.get(answer, "Not found")
 
-Student selected Option ID: {answer} (Text: "{user_selected_option_text}")
-
-Please perform the following:
-1.  Identify the ID of the *correct* option from the "Available Options" list.
-2.  Provide the text of the correct option.
-3.  Determine if the student's selected option (ID: {answer}) is correct.
-4.  Provide a concise explanation for why the correct option is indeed correct.
-5.  If the student's answer was incorrect, briefly explain the flaw in their choice or why the chosen option is wrong.
-
-Format your response STRICTLY as follows, ensuring each field is on a new line:
-Correctness: [Yes/No based on student's answer]
-CorrectOptionID: [ID of the correct option]
-CorrectOptionText: [Text of the correct option]
-Explanation: [Your explanation of why the correct option is correct, and feedback on student's choice if incorrect]
-AI_Feedback: [Any brief, general feedback or encouragement for the student, or a more detailed look if the explanation is simple]
-DetailedSolution: [Restate the correct option and a clear, comprehensive reason why it is the best answer among the choices. This can be similar to or expand on the Explanation.]
-"""
-        logger.info(f"Evaluating MCQ ID {question_id} with AI. User selected: {answer}. Prompt (condensed): {prompt[:200]}...")
+        stored = _QUESTION_STORE.get(question_id)
+        if stored is not None:
+            return await _evaluate_mcq_from_store(question_id, stored, answer)
+        
+        prompt_parts = [
+            "You are an AI computer science tutor evaluating a student's answer to a multiple-choice question.\nQuestion: ",
+            question_text,
+            "\n\nAvailable Options:\n",
+        ]
+        prompt_parts.extend(f"- Option ID: {opt.id}, Text: {opt.text}\n" for opt in options)
+        prompt_parts.append(f"\nStudent selected Option ID: {answer} (Text: \"{user_selected_option_text}\")\n\n")
+        prompt_parts.append(_MCQ_EVALUATION_INSTRUCTIONS.replace("{answer}", answer))
+        prompt = "".join(prompt_parts)
+        logger.info("Evaluating MCQ ID %s with AI. User selected: %s. Prompt (condensed): %s...", question_id, answer, prompt[:200])
         
         try:
-            response = await model.generate_content_async(prompt)
-            original_raw_text = str(response.text) 
-            logger.info(f"Original raw_text length: {len(original_raw_text)}")
-            logger.info(f"Original raw_text type: {type(original_raw_text)}")
-            logger.info(f"Original Raw Text For Regex Processing:\n>>>\n{original_raw_text}\n<<<" )
-
-            # --- Start Character Inspection & Sanitization ---
-            # Log ordinal values of characters around where 'CorrectOptionText:' is expected
-            try:
-                start_index = original_raw_text.lower().find('correctoptiontext:') - 15
-                if start_index < 0: start_index = 0
-                end_index = start_index + 60 # Log about 60 chars
-                if end_index > len(original_raw_text): end_index = len(original_raw_text)
-                
-                debug_snippet = original_raw_text[start_index:end_index]
-                char_ords = [(char, ord(char)) for char in debug_snippet]
-                logger.info(f"Char ordinals for snippet '...{debug_snippet}...': {char_ords}")
-            except Exception as e_inspect:
-                logger.error(f"Error during char inspection: {e_inspect}")
-
-            # Attempt to sanitize by keeping only printable ASCII and common whitespace
-            sanitized_raw_text = "".join(char for char in original_raw_text if 32 <= ord(char) <= 126 or char in '\n\r\t')
-            logger.info(f"Sanitized raw_text length: {len(sanitized_raw_text)}")
-            if len(sanitized_raw_text) != len(original_raw_text):
-                logger.warning("Length mismatch after sanitization! Some chars were removed.")
-                logger.info(f"Sanitized Raw Text For Regex Processing:\n>>>\n{sanitized_raw_text}\n<<<" )
-            
-            raw_text_to_use = sanitized_raw_text # Use sanitized text for regex
-            # --- End Character Inspection & Sanitization ---
-
-            is_correct_val = False
-            correct_option_id_val = None
-            correct_option_text_val = "Could not determine from AI." 
-            explanation_val = "AI could not provide a clear explanation." 
-            ai_feedback_val = None 
-            detailed_solution_val = None 
-
-            correctness_match = re.search(r"Correctness:\s*(Yes|No)", raw_text_to_use, re.IGNORECASE)
-            if correctness_match:
-                is_correct_val = correctness_match.group(1).lower() == 'yes'
-
-            correct_id_match = re.search(r"CorrectOptionID:\s*(\S+)", raw_text_to_use, re.IGNORECASE)
-            if correct_id_match:
-                correct_option_id_val = correct_id_match.group(1).strip()
-            
-            logger.info("Attempting to parse CorrectOptionText...") 
-            correct_text_match = re.search(r"CorrectOptionText:(.*)", raw_text_to_use, re.IGNORECASE | re.DOTALL) 
-            if correct_text_match:
-                parsed_cot = correct_text_match.group(1).strip() 
-                logger.info(f"DIAGNOSTIC PARSED CorrectOptionText (group 1, stripped): ###{parsed_cot}###") 
-                actual_cot_value = parsed_cot.split('\n')[0].strip()
-                if actual_cot_value:
-                    correct_option_text_val = actual_cot_value
-                    logger.info(f"Assigned CorrectOptionText: ###{correct_option_text_val}###")
-                else:
-                    logger.warning("Diagnostic Parsed CorrectOptionText (first line) was EMPTY after strip.")
-            else:
-                logger.warning("Diagnostic Regex for CorrectOptionText found NO MATCH.") 
-            
-            logger.info("Attempting to parse Explanation...") 
-            explanation_match = re.search(r"Explanation:\s*(.*?)(?=\s*AI_Feedback:|\s*DetailedSolution:|$)", raw_text_to_use, re.DOTALL | re.IGNORECASE) 
-            if explanation_match:
-                parsed_expl = explanation_match.group(1).strip()
-                logger.info(f"PARSED Explanation (stripped): ###{parsed_expl}###") 
-                if parsed_expl: 
-                    explanation_val = parsed_expl
-                else:
-                    logger.warning("Parsed Explanation was EMPTY after strip.") 
-            else:
-                logger.warning("Regex for Explanation found NO MATCH.") 
-
-            logger.info("Attempting to parse AI_Feedback...") 
-            ai_feedback_match = re.search(r"AI_Feedback:\s*(.*?)(?=\s*DetailedSolution:|$)", raw_text_to_use, re.DOTALL | re.IGNORECASE) 
-            if ai_feedback_match:
-                parsed_ai_feedback = ai_feedback_match.group(1).strip()
-                logger.info(f"PARSED AI_Feedback (stripped): ###{parsed_ai_feedback}###") 
-                if parsed_ai_feedback: 
-                    ai_feedback_val = parsed_ai_feedback
-                else:
-                    logger.warning("Parsed AI_Feedback was EMPTY after strip.") 
-            else:
-                logger.warning("Regex for AI_Feedback found NO MATCH.") 
-
-            logger.info("Attempting to parse DetailedSolution...") 
-            detailed_solution_match = re.search(r"DetailedSolution:\s*(.*)", raw_text_to_use, re.DOTALL | re.IGNORECASE) 
-            if detailed_solution_match:
-                parsed_ds = detailed_solution_match.group(1).strip()
-                logger.info(f"PARSED DetailedSolution (stripped): ###{parsed_ds}###") 
-                if parsed_ds: 
-                    detailed_solution_val = parsed_ds
-                else:
-                    logger.warning("Parsed DetailedSolution was EMPTY after strip.") 
-            else:
-                logger.warning("Regex for DetailedSolution found NO MATCH.") 
-
-            return schemas.CSSubmissionFeedbackResponse(
+            original_raw_text = await ai_utils.generate(prompt)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Original Raw Text For Regex Processing (length %d):\n>>>\n%s\n<<<", len(original_raw_text), original_raw_text)
+
+            # Strip control characters (keeping common whitespace) in a single C-level pass
+            sanitized_raw_text = original_raw_text.translate(_CTRL_TRANS)
+            if len(sanitized_raw_text) != len(original_raw_text) and logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Sanitization removed %d chars:\n>>>\n%s\n<<<", len(original_raw_text) - len(sanitized_raw_text), sanitized_raw_text)
+
+            fields = _parse_mcq_feedback_fields(sanitized_raw_text)
+
+            correctness = fields.get("correctness", "")
+            is_correct_val = correctness.lower().startswith("yes")
+            correct_option_id_val = fields["correct_option_id"].split()[0] if fields.get("correct_option_id") else None
+            correct_option_text_val = fields.get("correct_option_text") or "Could not determine from AI."
+            explanation_val = fields.get("explanation") or "AI could not provide a clear explanation."
+            ai_feedback_val = fields.get("ai_feedback") or None
+            detailed_solution_val = fields.get("detailed_solution") or None
+
+            missing = [field for field in _MCQ_FEEDBACK_LABELS.values() if not fields.get(field)]
+            if missing:
+                logger.warning("MCQ evaluation for Q_ID %s is missing fields: %s", question_id, missing)
+
+            return schemas.CSSubmissionFeedbackResponse.model_construct(
                 correct=is_correct_val,
                 explanation=explanation_val,
                 detailed_solution=detailed_solution_val,
@@ -330,7 +472,7 @@ DetailedSolution: [Restate the correct option and a clear, comprehensive reason
             )
 
         except Exception as e:
-            logger.error(f"Gemini MCQ evaluation failed for Q_ID {question_id}: {e}", exc_info=True)
+            logger.error("Gemini MCQ evaluation failed for Q_ID %s: %s", question_id, e, exc_info=True)
             return schemas.CSSubmissionFeedbackResponse(
                 correct=False,
                 explanation=f"Error during AI evaluation: {str(e)}. Please try again.",
@@ -341,70 +483,34 @@ DetailedSolution: [Restate the correct option and a clear, comprehensive reason
             )
 
     # --- AI Evaluation for Coding & Theory ---
-    model = genai.GenerativeModel('gemini-1.5-flash-latest')
-    prompt = f"You are an AI programming and computer science tutor evaluating a student's answer.\n\n"
-    prompt += f"Question Type: {question_type}\n"
-    prompt += f"Original Question: {question_text}\n"
-    prompt += f"Student's Answer: {answer}\n\n"
-
-    if question_type == "coding":
-        prompt += """
-        Please evaluate the student's Python code. Assess the following:
-        1. Correctness: Does the code likely solve the problem based on the description? (Answer Yes/No/Partially)
-        2. Explanation: Briefly explain if the code is correct, or why it's incorrect or incomplete.
-        3. AI Feedback: Provide specific, constructive feedback on the code's logic, style, potential bugs, or areas for improvement.
-        4. Detailed Solution: Provide a correct and idiomatic Python solution to the original problem.
-        5. Simulated Output: Describe the expected output for a simple test case (e.g., "Calling add(2, 3) should return 5"). Do NOT attempt to execute the code.
-        
-        Format your response clearly, label each section (Correctness, Explanation, AI Feedback, Detailed Solution, Simulated Output).
-        """
-    elif question_type == "theory":
-        prompt += """
-        Please evaluate the student's explanation. Assess the following:
-        1. Correctness: Is the explanation conceptually accurate and complete? (Answer Yes/No/Partially)
-        2. Explanation: Briefly explain why the student's answer is correct or where it falls short.
-        3. AI Feedback: Provide specific feedback on clarity, accuracy, depth, and examples used. Suggest improvements.
-        4. Detailed Solution: Provide a clear, concise, and accurate model answer to the original question.
-        
-        Format your response clearly, label each section (Correctness, Explanation, AI Feedback, Detailed Solution).
-        """
-    else: # Should not happen based on request schema
-        raise HTTPException(status_code=400, detail=f"Unsupported question type for evaluation: {question_type}")
+    prompt = _build_evaluation_prompt(question_type, question_text, answer)
 
-    logger.info(f"Evaluating {question_type} submission for Q_ID {question_id}. Prompt: {prompt[:150]}...")
+    logger.info("Evaluating %s submission for Q_ID %s. Prompt: %s...", question_type, question_id, prompt[:150])
     try:
-        response = await model.generate_content_async(prompt)
-
-        if response and hasattr(response, 'text'):
-            raw_text = response.text
-            logger.info(f"Gemini response received for submission eval. Length: {len(raw_text)}")
-            
-            # --- Parse the structured feedback ---
-            # This parsing needs to be robust. Using regex is one way.
-            correctness_str = re.search(r"Correctness:\s*(Yes|No|Partially)", raw_text, re.IGNORECASE)
-            explanation = re.search(r"Explanation:\s*(.*?)\s*(?:AI Feedback:|$)", raw_text, re.DOTALL | re.IGNORECASE)
-            ai_feedback = re.search(r"AI Feedback:\s*(.*?)\s*(?:Detailed Solution:|$)", raw_text, re.DOTALL | re.IGNORECASE)
-            detailed_solution = re.search(r"Detailed Solution:\s*(.*?)\s*(?:Simulated Output:|$)", raw_text, re.DOTALL | re.IGNORECASE)
-            simulated_output = re.search(r"Simulated Output:\s*(.*)", raw_text, re.DOTALL | re.IGNORECASE) if question_type == "coding" else None
-
-            is_correct = correctness_str.group(1).lower() == 'yes' if correctness_str else False # Default to False if not parsed
-            
-            # Create feedback response
-            return schemas.CSSubmissionFeedbackResponse(
-                correct=is_correct,
-                explanation=explanation.group(1).strip() if explanation else "Could not parse explanation.",
-                ai_feedback=ai_feedback.group(1).strip() if ai_feedback else None,
-                detailed_solution=detailed_solution.group(1).strip() if detailed_solution else None,
-                simulated_output=simulated_output.group(1).strip() if simulated_output else None
-            )
-            
-        elif response and hasattr(response, 'prompt_feedback') and response.prompt_feedback.block_reason:
-             raise HTTPException(status_code=500, detail=f"AI content evaluation blocked. Reason: {response.prompt_feedback.block_reason}")
-        else:
-             raise HTTPException(status_code=500, detail="AI model returned an unexpected or empty response for evaluation.")
-
+        raw_text = await ai_utils.generate(prompt)
+        logger.info("Gemini response received for submission eval. Length: %d", len(raw_text))
+        
+        # --- Parse the structured feedback ---
+        # This parsing needs to be robust. Using regex is one way.
+        correctness_str = _EVAL_CORRECTNESS_RE.search(raw_text)
+        explanation = _EVAL_EXPLANATION_RE.search(raw_text)
+        ai_feedback = _EVAL_AI_FEEDBACK_RE.search(raw_text)
+        detailed_solution = _EVAL_DETAILED_SOLUTION_RE.search(raw_text)
+        simulated_output = _EVAL_SIMULATED_OUTPUT_RE.search(raw_text) if question_type == "coding" else None
+
+        is_correct = correctness_str.group(1).lower() == 'yes' if correctness_str else False # Default to False if not parsed
+        
+        # Create feedback response
+        return schemas.CSSubmissionFeedbackResponse(
+            correct=is_correct,
+            explanation=explanation.group(1).strip() if explanation else "Could not parse explanation.",
+            ai_feedback=ai_feedback.group(1).strip() if ai_feedback else None,
+            detailed_solution=detailed_solution.group(1).strip() if detailed_solution else None,
+            simulated_output=simulated_output.group(1).strip() if simulated_output else None
+        )
+        
     except Exception as e:
-        logger.error(f"Gemini submission evaluation failed for Q_ID '{question_id}': {e}", exc_info=True)
+        logger.error("Gemini submission evaluation failed for Q_ID '%s': %s", question_id, e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"AI Evaluation Error: {str(e)}")
 
 
@@ -413,10 +519,10 @@ DetailedSolution: [Restate the correct option and a clear, comprehensive reason
 @router.post("/questions", response_model=schemas.CSQuestionResponse, summary="Get a Computer Science practice question")
 async def get_cs_question(request: schemas.CSQuestionRequest):
     """Generates a Computer Science practice question, optionally of a specific type."""
-    logger.info(f"Received request for CS question: chapter='{request.chapter_name}', type='{request.requested_question_type}'")
+    logger.info("Received request for CS question: chapter='%s', type='%s'", request.chapter_name, request.requested_question_type)
     try:
         # Pass the requested_question_type to the generation function
-        question = await generate_question_from_ai(request.chapter_name, request.requested_question_type)
+        question = await get_pooled_question(request.chapter_name, request.requested_question_type)
         return question
     except HTTPException as e:
         raise e
@@ -437,155 +543,163 @@ async def submit_cs_answer(submission: schemas.CSSubmissionRequest):
 
 def _parse_flashcards_from_text(text: str, chapter: str) -> List[schemas.FlashcardSchema]:
     """Parses AI response text to extract flashcards (Q/A pairs)."""
-    flashcards = []   
-    # Regex to find blocks starting with Q: or Question: and A: or Answer:
-    # It captures the text after Q: and A: until the next Q: or end of string.
-    # Using re.DOTALL so '.' matches newlines, and re.IGNORECASE for Q/A prefixes.
-    pattern = re.compile(r"(?:Q:|Question:)\s*(.*?)\s*(?:A:|Answer:)\s*(.*?)(?=\s*(?:Q:|Question:)|$)", re.DOTALL | re.IGNORECASE)
-    
-    matches = pattern.findall(text)
-    
-    for q_text, a_text in matches:
-        question = q_text.strip()
-        answer = a_text.strip()
-        if question and answer: # Ensure both are non-empty
-            flashcards.append(schemas.FlashcardSchema(question=question, answer=answer))
+    # Strip each Q/A pair once; keep only pairs where both are non-empty
+    pairs = ((m.group(1).strip(), m.group(2).strip()) for m in _FLASHCARD_RE.finditer(text))
+    flashcards = [schemas.FlashcardSchema(question=question, answer=answer) for question, answer in pairs if question and answer]
             
     if not flashcards:
-        logger.warning(f"Could not parse any flashcards for chapter '{chapter}' from raw text. Text: {text[:300]}...")
+        logger.warning("Could not parse any flashcards for chapter '%s' from raw text. Text: %s...", chapter, text[:300])
         # Optionally, return a single flashcard indicating parse error, or let it be an empty list
         # flashcards.append(schemas.FlashcardSchema(question="Parsing Error", answer="Could not extract flashcards from AI response."))
         
     return flashcards
 
-async def generate_flashcards_from_ai(chapter: str) -> schemas.FlashcardsResponse:
-    if not genai:
-        raise HTTPException(status_code=500, detail="AI Service not configured.")
-
-    model = genai.GenerativeModel('gemini-1.5-flash-latest')
+def _parse_key_point_line(line: str) -> Optional[str]:
+    """Returns the key point on a line starting with "-" or "<number>." (marker removed), else None."""
+    # Plain string checks are enough for these anchored markers; no regex needed.
+    stripped = line.strip()
+    if not stripped:
+        return None
+    if stripped[0] == '-':
+        return stripped[1:].lstrip()
+    head, sep, tail = stripped.partition('.')
+    if sep and head.isdigit() and tail and not tail[0].isdigit(): # "1. ", "12.\t", "3.Foo"; not "3.14 ..."
+        return tail.lstrip()
+    return None
+
+@require_ai
+@cached_response("chapter_aids", response_cache, key_args=_chapter_cache_args)
+async def generate_chapter_aids(chapter: str) -> schemas.ChapterAidsResponse:
+    """Generates flashcards, a summary and key points for a chapter in a single Gemini call."""
     prompt = f"""
-Generate 3-5 flashcards for the Computer Science chapter: '{chapter}'. 
-Each flashcard should have a clear Question and a concise Answer.
-Use the following format strictly for each flashcard:
+Create study materials for the Computer Science chapter: '{chapter}'.
+Respond with exactly the three sections below, in this order, each starting with its marker on its own line.
 
+===FLASHCARDS===
+3-5 flashcards. Each flashcard should have a clear Question and a concise Answer.
+Use the following format strictly for each flashcard:
 Q: [Your Question Here]
 A: [Your Answer Here]
 
-Q: [Another Question Here]
-A: [Another Answer Here]
+===SUMMARY===
+A concise educational summary (around 150-250 words) that covers the main concepts and is easy to understand for a student.
 
-(and so on...)
+===KEY_POINTS===
+A list of 5-7 key points. Each key point should be a concise statement. Start each key point with a hyphen (-) or a number followed by a period (e.g., '1.').
 """
 
-    logger.info(f"Generating AI flashcards for chapter: {chapter}")
+    logger.info("Generating AI chapter aids (flashcards, summary, key points) for chapter: %s", chapter)
     try:
-        response = await model.generate_content_async(prompt)
-
-        if response and hasattr(response, 'text') and response.text:
-            raw_text = response.text.strip()
-            parsed_flashcards = _parse_flashcards_from_text(raw_text, chapter)
-            
-            if not parsed_flashcards:
-                # If parsing failed, we might log and raise, or return empty/error flashcard
-                logger.warning(f"Flashcard parsing returned empty for {chapter}. Raw AI text: {raw_text[:500]}")
-                # Depending on desired behavior, could raise HTTPException or return with an error indicator
-                # For now, let's return empty if parsing fails, client can handle this.
-
-            logger.info(f"Gemini flashcards received and parsed for {chapter}. Count: {len(parsed_flashcards)}")
-            return schemas.FlashcardsResponse(chapter=chapter, flashcards=parsed_flashcards)
-        elif response and hasattr(response, 'prompt_feedback') and response.prompt_feedback.block_reason:
-            logger.error(f"AI flashcards generation blocked for {chapter}. Reason: {response.prompt_feedback.block_reason}")
-            raise HTTPException(status_code=500, detail=f"AI content generation blocked. Reason: {response.prompt_feedback.block_reason}")
-        else:
-            logger.error(f"AI model returned an unexpected or empty response for flashcards: {chapter}")
-            raise HTTPException(status_code=500, detail="AI model returned an empty or invalid response for flashcards.")
+        # Parse the response line by line as it streams in: key points are extracted immediately, and only
+        # the flashcard/summary lines are kept (no full copy of the response text is built)
+        section_lines: Dict[str, List[str]] = {"flashcards": [], "summary": []}
+        key_points: List[str] = []
+        seen_sections = set()
+        current_section = None
+        async for line in ai_utils.generate_lines(prompt):
+            marker = _CHAPTER_AIDS_SECTION_RE.match(line)
+            if marker:
+                current_section = marker.group(1).lower()
+                seen_sections.add(current_section)
+            elif current_section == "key_points":
+                point = _parse_key_point_line(line)
+                if point:
+                    key_points.append(point)
+            elif current_section is not None:
+                section_lines[current_section].append(line)
+
+        missing = [name for name in ("flashcards", "summary", "key_points") if name not in seen_sections]
+        if missing:
+            logger.warning("Chapter aids response for %s is missing sections %s.", chapter, missing)
+
+        sections = {name: "\n".join(lines).strip() for name, lines in section_lines.items()}
+        flashcards = _parse_flashcards_from_text(sections.get("flashcards", ""), chapter)
+        summary_text = sections.get("summary") or "Could not parse summary from AI response. Please try again."
+        if not key_points:
+            logger.warning("Could not parse key points from AI response for %s.", chapter)
+            # Fallback: return an error message as a single key point
+            key_points = list(_UNPARSED_KEY_POINTS_FALLBACK)
+
+        logger.info("Gemini chapter aids received for %s. Flashcards: %d, summary length: %d, key points: %d", chapter, len(flashcards), len(summary_text), len(key_points))
+        return schemas.ChapterAidsResponse(chapter=chapter, flashcards=flashcards, summary_text=summary_text, key_points=tuple(key_points))
 
     except Exception as e:
-        logger.error(f"Gemini flashcards generation failed for chapter '{chapter}': {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"AI Flashcards Generation Error: {str(e)}")
+        logger.error("Gemini chapter aids generation failed for chapter '%s': %s", chapter, e, exc_info=True)
+        raise HTTPException(status_code=500, detail=f"AI Chapter Aids Generation Error: {str(e)}")
 
-async def generate_summary_from_ai(chapter: str) -> schemas.SummaryResponse:
-    if not genai:
-        raise HTTPException(status_code=500, detail="AI Service not configured.")
-    
-    model = genai.GenerativeModel('gemini-1.5-flash-latest')
-    prompt = f"Generate a concise educational summary (around 150-250 words) for the Computer Science chapter: '{chapter}'. The summary should cover the main concepts and be easy to understand for a student."
-    
-    logger.info(f"Generating AI summary for chapter: {chapter}")
-    try:
-        response = await model.generate_content_async(prompt)
-        
-        if response and hasattr(response, 'text') and response.text:
-            summary_text = response.text.strip()
-            logger.info(f"Gemini summary received for {chapter}. Length: {len(summary_text)}")
-            return schemas.SummaryResponse(chapter=chapter, summary_text=summary_text)
-        elif response and hasattr(response, 'prompt_feedback') and response.prompt_feedback.block_reason:
-            logger.error(f"AI summary generation blocked for {chapter}. Reason: {response.prompt_feedback.block_reason}")
-            raise HTTPException(status_code=500, detail=f"AI content generation blocked. Reason: {response.prompt_feedback.block_reason}")
-        else:
-            logger.error(f"AI model returned an unexpected or empty response for summary: {chapter}")
-            raise HTTPException(status_code=500, detail="AI model returned an empty or invalid response for summary.")
+# The single-aid generators share the batched (and cached) call, so opening all three aids costs one Gemini request.
+# Their own responses are cached per (chapter, aid type) too, so repeat requests return the built model as-is.
+@cached_response("flashcards", response_cache, key_args=_chapter_cache_args)
+async def generate_flashcards_from_ai(chapter: str) -> schemas.FlashcardsResponse:
+    aids = await generate_chapter_aids(chapter)
+    return schemas.FlashcardsResponse(chapter=chapter, flashcards=aids.flashcards)
 
-    except Exception as e:
-        logger.error(f"Gemini summary generation failed for chapter '{chapter}': {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"AI Summary Generation Error: {str(e)}")
+@cached_response("summary", response_cache, key_args=_chapter_cache_args)
+async def generate_summary_from_ai(chapter: str) -> schemas.SummaryResponse:
+    aids = await generate_chapter_aids(chapter)
+    return schemas.SummaryResponse(chapter=chapter, summary_text=aids.summary_text)
 
+@cached_response("key_points", response_cache, key_args=_chapter_cache_args)
 async def generate_key_points_from_ai(chapter: str) -> schemas.KeyPointsResponse:
-    if not genai:
-        raise HTTPException(status_code=500, detail="AI Service not configured.")
-
-    model = genai.GenerativeModel('gemini-1.5-flash-latest')
-    prompt = f"Generate a list of 5-7 key points for the Computer Science chapter: '{chapter}'. Each key point should be a concise statement. Start each key point with a hyphen (-) or a number followed by a period (e.g., '1.')."
-
-    logger.info(f"Generating AI key points for chapter: {chapter}")
-    try:
-        response = await model.generate_content_async(prompt)
-
-        if response and hasattr(response, 'text') and response.text:
-            raw_text = response.text.strip()
-            # Simple parsing: split by newline and filter out empty lines or non-keypoint lines.
-            # This assumes the AI follows the hyphen or number list format.
-            key_points = [line.strip() for line in raw_text.split('\n') 
-                          if line.strip() and (line.strip().startswith('-') or re.match(r"^\d+\.\s", line.strip()))]
-            
-            # Remove the leading markers (-, 1., etc.) for cleaner display
-            cleaned_key_points = []
-            for point in key_points:
-                if point.startswith('-'):
-                    cleaned_key_points.append(point[1:].strip())
-                elif re.match(r"^\d+\.\s", point):
-                    cleaned_key_points.append(re.sub(r"^\d+\.\s*", "", point).strip())
-                else:
-                    cleaned_key_points.append(point) # Should not happen if AI follows format
-            
-            if not cleaned_key_points:
-                 logger.warning(f"Could not parse key points from AI response for {chapter}. Raw: {raw_text}")
-                 # Fallback: return the raw text as a single key point or an error message
-                 cleaned_key_points = ["Could not parse key points from AI response. Please try again."]
-
-            logger.info(f"Gemini key points received for {chapter}. Count: {len(cleaned_key_points)}")
-            return schemas.KeyPointsResponse(chapter=chapter, key_points=cleaned_key_points)
-        elif response and hasattr(response, 'prompt_feedback') and response.prompt_feedback.block_reason:
-            logger.error(f"AI key points generation blocked for {chapter}. Reason: {response.prompt_feedback.block_reason}")
-            raise HTTPException(status_code=500, detail=f"AI content generation blocked. Reason: {response.prompt_feedback.block_reason}")
-        else:
-            logger.error(f"AI model returned an unexpected or empty response for key points: {chapter}")
-            raise HTTPException(status_code=500, detail="AI model returned an empty or invalid response for key points.")
-
-    except Exception as e:
-        logger.error(f"Gemini key points generation failed for chapter '{chapter}': {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"AI Key Points Generation Error: {str(e)}")
+    aids = await generate_chapter_aids(chapter)
+    return schemas.KeyPointsResponse(chapter=chapter, key_points=aids.key_points)
 
 # --- Learning Aids Endpoint ---
+# aid_type -> generator; LearningAidRequest.aid_type is a Literal of exactly these keys
+_AID_DISPATCH = {
+    "flashcards": generate_flashcards_from_ai,
+    "summary": generate_summary_from_ai,
+    "key_points": generate_key_points_from_ai,
+}
+
 @router.post("/learning-aids", response_model=schemas.LearningAidResponse, summary="Get AI-generated learning aids for a CS chapter")
 async def get_learning_aid(request: schemas.LearningAidRequest):
     """Fetches AI-generated learning aids (flashcards, summary, or key points) for a given CS chapter."""
-    if request.aid_type == "flashcards":
-        return await generate_flashcards_from_ai(request.chapter_name)
-    elif request.aid_type == "summary":
-        return await generate_summary_from_ai(request.chapter_name)
-    elif request.aid_type == "key_points":
-        return await generate_key_points_from_ai(request.chapter_name)
-    else:
-        # This case should ideally be prevented by Pydantic validation of Literal
-        raise HTTPException(status_code=400, detail=f"Invalid learning aid type: {request.aid_type}") 
\ No newline at end of file
+    handler = _AID_DISPATCH[request.aid_type] # Literal already validated by Pydantic
+    return await handler(request.chapter_name)
+
+@router.post("/chapter-aids", response_model=schemas.ChapterAidsResponse, summary="Get flashcards, summary and key points for a CS chapter in one request")
+async def get_chapter_aids(request: schemas.ChapterAidsRequest):
+    """Fetches all AI-generated learning aids for a given CS chapter from a single batched AI call."""
+    return await generate_chapter_aids(request.chapter_name)
+
+
+# --- Streaming Endpoints (free-form text only; structured MCQ parsing stays on /submit) ---
+async def _stream_ai_text(prompt: str, log_context: str):
+    """Forwards Gemini's response to the client as SSE "data" events, ending with a "done" (or "error") event."""
+    try:
+        async for chunk in ai_utils.generate_stream(prompt):
+            yield sse_event({"text": chunk})
+        yield sse_event({}, event="done")
+    except Exception as e:
+        logger.error("Gemini streaming failed for %s: %s", log_context, e, exc_info=True)
+        yield sse_error(e)
+
+def _summary_prompt(chapter: str) -> str:
+    return f"Generate a concise educational summary (around 150-250 words) for the Computer Science chapter: '{chapter}'. The summary should cover the main concepts and be easy to understand for a student."
+
+@router.post("/submit-stream", summary="Stream AI feedback for a coding or theory answer")
+@require_ai
+async def submit_cs_answer_stream(submission: schemas.CSSubmissionRequest):
+    """Streams the AI evaluation of a coding/theory answer as Server-Sent Events (text as it is generated)."""
+    if submission.question_type == "mcq":
+        raise HTTPException(status_code=400, detail="MCQ answers are evaluated via /cs/submit.")
+
+    prompt = _build_evaluation_prompt(submission.question_type, submission.question_text, submission.answer)
+    logger.info("Streaming %s evaluation for Q_ID %s.", submission.question_type, submission.question_id)
+    return StreamingResponse(_stream_ai_text(prompt, f"Q_ID {submission.question_id}"), media_type="text/event-stream")
+
+@router.post("/summary-stream", summary="Stream an AI-generated summary for a CS chapter")
+@require_ai
+async def get_summary_stream(request: schemas.ChapterAidsRequest):
+    """Streams a chapter summary as Server-Sent Events. A summary already cached from /chapter-aids is sent at once."""
+    chapter = request.chapter_name
+    cached_aids = response_cache.get(make_cache_key("chapter_aids", args=_chapter_cache_args(chapter)))
+    if cached_aids is not None:
+        async def cached_summary():
+            yield sse_event({"text": cached_aids.summary_text})
+            yield sse_event({}, event="done")
+        return StreamingResponse(cached_summary(), media_type="text/event-stream")
+
+    logger.info("Streaming AI summary for chapter: %s", chapter)
+    return StreamingResponse(_stream_ai_text(_summary_prompt(chapter), f"summary of chapter '{chapter}'"), media_type="text/event-stream")
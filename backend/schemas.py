@@ -1,7 +1,15 @@
-from pydantic import BaseModel, EmailStr, constr, Field
-from typing import Optional, List, Dict, Any, Literal, Union
+from pydantic import BaseModel, ConfigDict, EmailStr, Field
+from typing import Annotated, Optional, List, Dict, Any, Literal, Union
+from typing_extensions import TypedDict # pydantic requires typing_extensions.TypedDict before Python 3.12
 from datetime import date, datetime # For _FullPuzzleStore if moved here
 
+# --- Shared Base for Schemas Read From ORM Objects ---
+class ORMModel(BaseModel):
+    model_config = ConfigDict(from_attributes=True) # Validated straight from ORM rows/attributes by pydantic-core
+
+class StrictRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid", str_strip_whitespace=True) # Unknown fields rejected, text trimmed during validation
+
 # --- Base User Schemas (not directly used by API usually, but good for inheritance) ---
 class UserBase(BaseModel):
     email: EmailStr
@@ -19,36 +27,28 @@ class UserCreate(UserBase):
 # Your get_current_user currently returns the SQLAlchemy model directly, which is fine.
 # This Pydantic UserInDB was used for the fake_users_db list.
 # For consistency with SQLAlchemy model, ensure fields match.
-class UserInDB(UserBase):
+class UserInDB(UserBase, ORMModel):
     id: int # Assuming your SQLAlchemy User model will have an id from the DB
     hashed_password: str # This would be from the DB
     current_xp: int = 0
     # disabled: Optional[bool] = None # If you add this to your DB model
 
-    class Config:
-        from_attributes = True
-
 # --- Schemas for API Responses --- 
-class UserResponse(UserBase):  # For public user data (e.g., in TokenResponse, /api/users/me)
+class UserResponse(UserBase, ORMModel):  # For public user data (e.g., in TokenResponse, /api/users/me)
     id: int
     # name: str # Already in UserBase
     # email: EmailStr # Already in UserBase
     current_xp: int # Often useful to return current_xp
 
-    class Config:
-        from_attributes = True
-
-class UserDataResponse(UserBase): # For /user/data endpoint
+class UserDataResponse(UserBase, ORMModel): # For /user/data endpoint
     id: int # Usually good to include the ID
     # name: str # Already in UserBase
     # email: EmailStr # Already in UserBase
     current_xp: int
 
-    class Config:
-        from_attributes = True
-
 # --- Token Schemas --- 
 class TokenData(BaseModel):
+    model_config = ConfigDict(frozen=True, extra="forbid")
     email: Optional[str] = None # Or user_id, depending on what's in JWT 'sub'
 
 class TokenResponse(BaseModel):
@@ -60,7 +60,7 @@ class TokenResponse(BaseModel):
 class UserRegistrationRequest(BaseModel):
     name: str
     email: EmailStr
-    password: constr(min_length=6)
+    password: Annotated[str, Field(min_length=6)]
 
 class RegistrationResponse(BaseModel):
     message: str
@@ -69,17 +69,16 @@ class RegistrationResponse(BaseModel):
 
 # --- Schemas for Math Solver & Explanations (can be moved here from main.py) ---
 class Step(BaseModel):
+    model_config = ConfigDict(frozen=True, extra="forbid") # Small value model built many times per response
     step_number: int
     explanation: str
 
-class SolutionResponse(BaseModel):
+class SolutionResponse(ORMModel):
     original_problem: Optional[str] = None
     steps: List[Step]
     final_answer: Optional[str] = None
     error: Optional[str] = None
     updated_xp: Optional[int] = None
-    class Config:
-        from_attributes = True
 
 class ExplanationRequest(BaseModel):
     problem_text: str
@@ -87,66 +86,55 @@ class ExplanationRequest(BaseModel):
     step_number_to_explain: int
     query_type: str
 
-class ExplanationResponse(BaseModel):
+class ExplanationResponse(ORMModel):
     explanation: str
     error: Optional[str] = None
     updated_xp: Optional[int] = None
-    class Config:
-        from_attributes = True
 
-class PracticeRequest(BaseModel):
+class PracticeRequest(StrictRequest):
     topic: str
     previous_problem: Optional[str] = None
 
-class PracticeResponse(BaseModel):
+class PracticeResponse(ORMModel):
     problem: Optional[str] = None
     solution_explanation: Optional[str] = None
     error: Optional[str] = None
     updated_xp: Optional[int] = None
-    class Config:
-        from_attributes = True
 
 # --- Daily Puzzle Schemas (Moved from main.py) ---
-class DailyPuzzleResponse(BaseModel):
+class DailyPuzzleResponse(ORMModel):
     puzzle_id: str
     question: str
     difficulty: Optional[str] = None
-    class Config:
-        from_attributes = True # Good practice, though may not be directly from DB always
 
-class _FullPuzzleStore(BaseModel): # Internal, not for API response directly but used by _cached_daily_puzzle
+class _FullPuzzleStore(ORMModel): # Internal, not for API response directly but used by _cached_daily_puzzle
     puzzle_id: str
     question: str
     answer: str
     difficulty: Optional[str]
     generated_on_date: date # Ensure date is imported from datetime at the top
-    class Config:
-        from_attributes = True
 
 class SubmitPuzzleRequest(BaseModel):
     puzzle_id: str
     user_answer: str
 
-class SubmitPuzzleResponse(BaseModel):
+class SubmitPuzzleResponse(ORMModel):
     is_correct: bool
     message: str
     correct_answer: Optional[str] = None
     puzzle_id: str
-    class Config:
-        from_attributes = True
 
 # --- Schemas for Image Upload / OCR ---
 class ImageUploadResponse(BaseModel):
     status: str
     extracted_text: Optional[str] = None
+    image_hash: Optional[str] = None # Store in a bookmark's metadata_json to skip OCR on re-upload
     error: Optional[str] = None
-    # class Config: # Not strictly necessary if not mapping from DB model directly
-    #     from_attributes = True # Pydantic V2 style
 
-class SolveTextRequest(BaseModel):
+class SolveTextRequest(StrictRequest):
     question_text: str
 
-class ProblemRequest(BaseModel): # This might be used by /generate-solution
+class ProblemRequest(StrictRequest): # This might be used by /generate-solution
     problem_text: str
 
 # --- Schemas for Drawing Recognition ---
@@ -156,18 +144,14 @@ class DrawingRequest(BaseModel):
 class RecognitionResponse(BaseModel):
     recognized_text: Optional[str] = None
     error: Optional[str] = None
-    # class Config:
-    #     from_attributes = True
 
 # --- Schemas for Graphing ---
-class GraphRequest(BaseModel):
+class GraphRequest(StrictRequest):
     equation: str
 
 class GraphResponse(BaseModel):
     image_data_url: Optional[str] = None
     error: Optional[str] = None
-    # class Config:
-    #     from_attributes = True
 
 # --- Schemas for Mistake Diagnosis ---
 class DiagnoseSolutionRequest(BaseModel):
@@ -177,28 +161,24 @@ class DiagnoseSolutionRequest(BaseModel):
 class DiagnoseSolutionResponse(BaseModel):
     feedback: str
     error: Optional[str] = None
-    # class Config:
-    #     from_attributes = True
 
 # --- Bookmark Schemas ---
 class BookmarkBase(BaseModel):
     question_text: str
     question_source: Optional[str] = None
-    metadata_json: Optional[Dict[Any, Any]] = None # Or just Optional[Any] if more flexible
+    metadata_json: Optional[Dict[str, Any]] = None # JSON object keys are always strings
 
 class BookmarkCreate(BookmarkBase):
     pass # No extra fields needed for creation beyond BookmarkBase, user_id comes from token
 
-class BookmarkResponse(BookmarkBase):
+class BookmarkResponse(BookmarkBase, ORMModel):
     id: int
     user_id: int # Good to show who owns the bookmark
     created_at: datetime # To show when it was bookmarked
 
-    class Config:
-        from_attributes = True # For Pydantic V2 (was orm_mode)
-
 # --- Schemas for Chat History (NEW) ---
-class ChatMessageSchema(BaseModel):
+class ChatMessageSchema(TypedDict): # Validated as a plain dict; history is only read, never rebuilt
+    __pydantic_config__ = ConfigDict(extra="forbid")
     sender: str # "user" or "ai"
     text: str
     # We don't necessarily need timestamp or id for the history context for Gemini
@@ -212,11 +192,6 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     answer: str
 
-# --- Schemas for Image Upload & OCR ---
-# ... existing code ...
-
-# ... (You can move other Pydantic models like GraphRequest etc. here too if not already done) ... 
-
 # --- Schemas for /cs/questions ---
 
 class CSQuestionRequest(BaseModel):
@@ -227,6 +202,7 @@ class CSQuestionRequest(BaseModel):
 # --- Response Schemas (mirroring TypeScript interfaces) ---
 
 class MCQOptionSchema(BaseModel):
+    model_config = ConfigDict(frozen=True, extra="forbid")
     id: str
     text: str
 
@@ -237,19 +213,22 @@ class BaseCSQuestionSchema(BaseModel):
     question_type: Literal["mcq", "coding", "theory"] # Type added to base
 
 class MCQQuestionResponseSchema(BaseCSQuestionSchema):
-    question_type: Literal["mcq"] = "mcq"
+    question_type: Literal["mcq"] = Field(default="mcq", frozen=True)
     options: List[MCQOptionSchema] = Field(..., min_items=2)
 
 class CodingProblemResponseSchema(BaseCSQuestionSchema):
-    question_type: Literal["coding"] = "coding"
+    question_type: Literal["coding"] = Field(default="coding", frozen=True)
     initial_code_stub: Optional[str] = None
     # language: Optional[str] = "python" 
 
 class TheoryQuestionResponseSchema(BaseCSQuestionSchema):
-    question_type: Literal["theory"] = "theory"
+    question_type: Literal["theory"] = Field(default="theory", frozen=True)
     
-# Use Union for the response model in the endpoint definition
-CSQuestionResponse = Union[MCQQuestionResponseSchema, CodingProblemResponseSchema, TheoryQuestionResponseSchema]
+# Use Union for the response model in the endpoint definition; tagged by question_type so validation dispatches in one lookup
+CSQuestionResponse = Annotated[
+    Union[MCQQuestionResponseSchema, CodingProblemResponseSchema, TheoryQuestionResponseSchema],
+    Field(discriminator="question_type"),
+]
 
 
 # --- Schemas for /cs/submit ---
@@ -279,31 +258,41 @@ class LearningAidRequest(BaseModel):
     # user_id: Optional[str] = None # For future personalization
 
 class FlashcardSchema(BaseModel):
+    model_config = ConfigDict(frozen=True, extra="forbid")
     question: str
     answer: str
 
 class FlashcardsResponse(BaseModel):
     chapter: str
-    aid_type: Literal["flashcards"] = "flashcards"
+    aid_type: Literal["flashcards"] = Field(default="flashcards", frozen=True)
     flashcards: List[FlashcardSchema]
 
 class SummaryResponse(BaseModel):
     chapter: str
-    aid_type: Literal["summary"] = "summary"
+    aid_type: Literal["summary"] = Field(default="summary", frozen=True)
     summary_text: str # Changed from 'summary' to 'summary_text' to avoid potential Pydantic model naming conflicts
 
 class KeyPointsResponse(BaseModel):
     chapter: str
-    aid_type: Literal["key_points"] = "key_points"
-    key_points: List[str]
+    aid_type: Literal["key_points"] = Field(default="key_points", frozen=True)
+    key_points: tuple[str, ...] = Field(..., min_length=1) # Built once by the server; never empty (a fallback message is used)
+
+LearningAidResponse = Annotated[
+    Union[FlashcardsResponse, SummaryResponse, KeyPointsResponse],
+    Field(discriminator="aid_type"), # Tagged union: dispatch on aid_type instead of trying each member
+]
 
-LearningAidResponse = Union[FlashcardsResponse, SummaryResponse, KeyPointsResponse]
+class ChapterAidsRequest(BaseModel):
+    chapter_name: str
+
+class ChapterAidsResponse(BaseModel): # All three learning aids from one batched AI call
+    chapter: str
+    flashcards: List[FlashcardSchema]
+    summary_text: str
+    key_points: tuple[str, ...] = Field(..., min_length=1)
 
 # --- Schemas for Admin User View ---
-class AdminUserView(UserBase): # Inherits email and name from UserBase
+class AdminUserView(UserBase, ORMModel): # Inherits email and name from UserBase
     id: int
     current_xp: int
     # We explicitly DO NOT include hashed_password or other sensitive fields
-
-    class Config:
-        from_attributes = True 
\ No newline at end of file
@@ -0,0 +1,92 @@
+"""Embedding-similarity cache for near-duplicate math problems.
+
+Optional: enabled only when sentence-transformers and faiss are installed.
+"""
+import asyncio
+import logging
+import re
+from typing import Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# --- Semantic Cache Settings ---
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+SIMILARITY_THRESHOLD = 0.93 # Cosine similarity needed to reuse a cached answer
+SEMANTIC_CACHE_MAX_ENTRIES = 10_000 # Index is reset once full
+
+# --- Optional: sentence-transformers + FAISS ---
+_model = None
+try:
+    import faiss
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+    _model = SentenceTransformer(EMBEDDING_MODEL_NAME) # Loaded once at import
+    logger.info("Semantic cache enabled (%s).", EMBEDDING_MODEL_NAME)
+except ImportError:
+    logger.info("sentence-transformers/faiss not installed. Semantic solver cache disabled.")
+except Exception as e:
+    logger.error("Error loading embedding model for semantic cache: %s", e)
+    _model = None
+
+
+# Words that change the math (functions and operations); other words are ignored by the signature
+_MATH_WORDS = frozenset({
+    "sin", "cos", "tan", "cot", "sec", "csc", "arcsin", "arccos", "arctan", "sinh", "cosh", "tanh",
+    "log", "ln", "exp", "sqrt", "abs", "mod", "pi", "lim", "sum", "max", "min",
+    "solve", "simplify", "factor", "factorise", "factorize", "expand", "evaluate",
+    "derivative", "differentiate", "integral", "integrate", "limit", "area", "perimeter", "volume",
+})
+_WORD_RE = re.compile(r"[a-z]{2,}")
+
+def _math_signature(text: str) -> str:
+    """The problem with whitespace and filler words removed. "Solve 2x+5=11" and "solve 2x + 5 = 13" embed
+    almost identically, so a semantic hit also requires an identical signature."""
+    without_filler = _WORD_RE.sub(lambda m: m.group() if m.group() in _MATH_WORDS else "", text.lower())
+    return "".join(without_filler.split()).rstrip("?.!")
+
+
+class SemanticCache:
+    """Top-1 cosine lookup over normalized embeddings (FAISS IndexFlatIP)."""
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES):
+        self._threshold = threshold
+        self._max_entries = max_entries
+        self._index = None
+        self._entries: List[tuple] = [] # Row in the index -> (signature, result)
+
+    @property
+    def enabled(self) -> bool:
+        return _model is not None
+
+    async def embed(self, text: str):
+        """Normalized embedding of `text` (computed off the event loop), or None when disabled."""
+        if not self.enabled:
+            return None
+        vector = await asyncio.to_thread(_model.encode, [text], normalize_embeddings=True)
+        return np.asarray(vector, dtype="float32")
+
+    def search(self, text: str, embedding) -> Optional[Any]:
+        if embedding is None or self._index is None or self._index.ntotal == 0:
+            return None
+        scores, rows = self._index.search(embedding, 1)
+        score, row = float(scores[0][0]), int(rows[0][0])
+        if row < 0 or score < self._threshold:
+            return None
+        signature, result = self._entries[row]
+        if signature != _math_signature(text):
+            return None
+        logger.info("Semantic cache hit (similarity %.3f).", score)
+        return result
+
+    def add(self, text: str, embedding, result: Any) -> None:
+        if embedding is None:
+            return
+        if self._index is None or self._index.ntotal >= self._max_entries:
+            self._index = faiss.IndexFlatIP(embedding.shape[1])
+            self._entries = []
+        self._index.add(embedding)
+        self._entries.append((_math_signature(text), result))
+
+
+# Shared instance
+solver_semantic_cache = SemanticCache()
@@ -1,11 +1,22 @@
 """Math Solving and Explanation Utilities"""
+import ast
 import logging
-from typing import Dict, List, Any
+import math
+import operator
+import unicodedata
+from fractions import Fraction
+from typing import AsyncIterator, Dict, List, Any, Optional
+import orjson
 from fastapi import HTTPException
 # Remove sympy if no longer used
 # import sympy
 # from sympy.parsing.sympy_parser import parse_expr, standard_transformations, implicit_multiplication_application
 from . import config # Relative import
+from . import cache
+from .ai_cache import cached_response, make_cache_key, solver_cache
+from .limiter import llm_limiter
+from .semantic_cache import solver_semantic_cache
+from datetime import date
 import re # Import regex module
 
 logger = logging.getLogger(__name__)
@@ -25,102 +36,226 @@ except ImportError:
 except Exception as e:
     logger.error(f"Error configuring Google Generative AI for Solver: {e}")
 
+GEMINI_MODEL_NAME = 'gemini-1.5-flash-latest'
+# Shared model instance; created once instead of per request
+_GEMINI_MODEL = genai.GenerativeModel(GEMINI_MODEL_NAME) if genai else None
+
+# --- Precompiled Patterns ---
+_LAST_STEP_RE = re.compile(r'([a-zA-Z]\s*=[^=]+)$|=([^=]+)$') # "x = 5" / "= 5" at the end of a step
+
 # --- Helper to Parse Gemini Response (Improved Basic) ---
+def _strip_list_marker(line: str) -> str:
+    """Removes a leading "1.", "2)", "-", "*" or "+" list marker from an already stripped line.
+
+    A marker must be followed by whitespace, so "-2x = 4" and "2.5 + 1 = 3.5" are left intact.
+    """
+    if line[:1] in ("-", "*", "+") and line[1:2].isspace():
+        return line[2:].lstrip()
+    digits = len(line) - len(line.lstrip("0123456789"))
+    if digits and line[digits:digits + 1] in (".", ")") and line[digits + 1:digits + 2].isspace():
+        return line[digits + 2:].lstrip()
+    return line
+
+# Section marker -> section it starts. The first occurrence of each section wins.
+_SECTION_MARKERS = {
+    "explanation": "explanation",
+    "summary": "explanation",
+    "steps": "steps",
+    "step-by-step": "steps",
+    "working": "steps",
+    "final answer": "solution",
+    "solution": "solution",
+    "result": "solution",
+}
+# Markers only count at the start of a line, so "Divide the result: x = 3" inside a step is left alone
+_SECTION_MARKER_RE = re.compile(r"^\s*(final answer|explanation|step-by-step|solution|summary|working|result|steps):", re.IGNORECASE | re.MULTILINE)
+
+def _split_solver_sections(text: str) -> Dict[str, str]:
+    """Finds all section markers in one finditer pass and slices each section up to the next marker.
+
+    The text before the first marker is returned as "preamble".
+    """
+    starts: List[tuple] = [] # (marker position, content start, section), in text order
+    seen = set()
+    for match in _SECTION_MARKER_RE.finditer(text):
+        section = _SECTION_MARKERS[match.group(1).lower()]
+        if section not in seen:
+            seen.add(section)
+            starts.append((match.start(), match.end(), section))
+
+    sections = {"preamble": text[:starts[0][0]].strip() if starts else text.strip()}
+    for i, (_, content_start, section) in enumerate(starts):
+        end = starts[i + 1][0] if i + 1 < len(starts) else len(text)
+        sections[section] = text[content_start:end].strip()
+    return sections
+
 def _parse_gemini_solver_response(text: str) -> Dict[str, Any]:
     """Attempts to parse the Gemini response into solution, steps, and explanation."""
+    sections = _split_solver_sections(text)
     solution = []
     steps = []
-    explanation = text # Default: treat everything as explanation initially
-
-    # Try to find common markers - this is heuristic and may need refinement
-    solution_match = re.search(r"(?:final answer|solution|result):\s*(.*)", text, re.IGNORECASE | re.DOTALL)
-    steps_match = re.search(r"(?:steps|step-by-step|working):\s*(.*)", text, re.IGNORECASE | re.DOTALL)
-    explanation_match = re.search(r"(?:explanation|summary):\s*(.*)", text, re.IGNORECASE | re.DOTALL)
-
-    # Extract explanation first if clearly marked
-    if explanation_match:
-        explanation = explanation_match.group(1).strip()
-        # Remove explanation part from the main text to avoid duplication
-        text = text[:explanation_match.start()] + text[explanation_match.end():]
 
     # Extract steps if clearly marked
-    if steps_match:
-        steps_text = steps_match.group(1).strip()
+    if "steps" in sections:
         # Simple split by newline, remove empty lines and list markers
-        steps = [re.sub(r'^\s*\d+[.)]?\s*|^\s*[-*+]\s*', '', line).strip() 
-                 for line in steps_text.split('\n') if line.strip()]
-        # Remove steps part from the main text
-        text = text[:steps_match.start()] + text[steps_match.end():]
-        # If explanation wasn't explicitly marked, use the remaining text before steps
-        if not explanation_match:
-             explanation_part_before = text[:steps_match.start()].strip()
-             if explanation_part_before:
-                 explanation = explanation_part_before
-             else: # If nothing before steps, use a generic explanation or the raw text if needed
-                  explanation = "See steps above." # Or maybe keep original full text?
+        steps = [_strip_list_marker(stripped)
+                 for stripped in map(str.strip, sections["steps"].splitlines()) if stripped]
 
     # Extract solution if clearly marked
-    if solution_match:
-        solution_text = solution_match.group(1).strip()
+    if "solution" in sections:
         # Split potential multiple solutions, handle simple cases
-        solution = [s.strip() for s in solution_text.split('\n') if s.strip()]
-        # Remove solution part from main text
-        text = text[:solution_match.start()] + text[solution_match.end():]
-        # Refine explanation if needed
-        if not explanation_match and not steps_match:
-             explanation = text.strip() # Use whatever remains
-
-    # Fallback logic if markers are missing
-    if not explanation_match and not steps_match and not solution_match:
-         explanation = text # Everything is explanation
-    elif not solution and steps: # If steps found but no explicit solution
+        solution = [s.strip() for s in sections["solution"].split('\n') if s.strip()]
+
+    # Explanation: the marked section, else whatever came before the first marker
+    if "explanation" in sections:
+        explanation = sections["explanation"]
+    elif len(sections) == 1: # No markers at all: everything is explanation
+        explanation = sections["preamble"]
+    elif sections["preamble"]:
+        explanation = sections["preamble"]
+    else:
+        explanation = "See steps above." if steps else ""
+
+    if not solution and steps: # If steps found but no explicit solution
         # Crude check: Is the last step likely an answer (e.g., x = 5)?
-        last_step_match = re.search(r'([a-zA-Z]\s*=[^=]+)$|=([^=]+)$', steps[-1])
+        last_step_match = _LAST_STEP_RE.search(steps[-1])
         if last_step_match:
             potential_solution = last_step_match.group(1) or last_step_match.group(2)
             if potential_solution:
                  solution = [potential_solution.strip()]
-                 # Optionally remove from steps if needed
-                 # steps = steps[:-1]
     
     # If still no explanation, but we have steps/solution, provide generic one
     if not explanation and (steps or solution):
         explanation = "Solution details provided."
 
-    # Ensure solution is a list
-    if not isinstance(solution, list):
-        solution = [str(solution)]
-    if len(solution) == 1 and not solution[0]: # Handle empty string case
-         solution = None
-
     return {
         "solution": solution if solution else None,
         "steps": steps if steps else None,
-        "explanation": explanation.strip() if explanation else None,
+        "explanation": explanation if explanation else None,
         "error": None # Assuming parsing success doesn't mean functional error
     }
 
-# --- Core Solving Logic (Using Gemini) ---
-async def solve_math_problem(question_text: str) -> Dict[str, Any]:
-    """Solves a math problem using the Gemini API."""
-    logger.info(f"Attempting to solve using Gemini: {question_text[:60]}...")
-
-    if not genai:
-        logger.error("Gemini API client not configured or key is missing.")
-        raise HTTPException(status_code=501, # 501 Not Implemented
-                            detail="Math solving via AI model is not configured on the server.")
+def _response_text(response) -> Optional[str]:
+    """response.text, read once. The SDK rebuilds it from the candidate parts on every access
+    (hasattr() included) and raises ValueError when there are none."""
+    try:
+        return response.text if response else None
+    except (AttributeError, ValueError):
+        return None
+
+# --- Deterministic Arithmetic (no LLM) ---
+# "2+2", "what is sqrt(16)?" and the like are evaluated locally with exact fractions; anything else goes to Gemini
+_ARITHMETIC_PREFIXES = ("what is", "what's", "compute", "calculate", "evaluate", "simplify", "solve")
+_ARITHMETIC_MAX_LENGTH = 100
+_ARITHMETIC_MAX_BITS = 4096 # Caps 9**9**9-style inputs and every intermediate result (str() limit is 4300 digits)
+_ARITHMETIC_OPS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+    ast.Pow: operator.pow,
+}
 
-    # --- Call Gemini API ---
+def _exact_sqrt(value: Fraction) -> Fraction:
+    """Square root of a perfect-square fraction; raises ValueError for anything irrational or negative."""
+    if value < 0:
+        raise ValueError("Square root of a negative number")
+    root = Fraction(math.isqrt(value.numerator), math.isqrt(value.denominator))
+    if root * root != value:
+        raise ValueError("Irrational square root")
+    return root
+
+_ARITHMETIC_FUNCS = {"sqrt": _exact_sqrt, "abs": abs}
+
+def _checked_number(value):
+    """`value` if it is an exact fraction of bounded size; raises ValueError otherwise."""
+    if not isinstance(value, Fraction):
+        raise ValueError("Result is not an exact rational number") # e.g. (-8)**(1/3) is complex
+    if max(value.numerator.bit_length(), value.denominator.bit_length()) > _ARITHMETIC_MAX_BITS:
+        raise ValueError("Result too large")
+    return value
+
+def _eval_arithmetic(node: ast.AST) -> Fraction:
+    """Evaluates a whitelisted numeric AST exactly; raises ValueError for anything else."""
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        # Via repr, so the literal 0.1 becomes 1/10 rather than the nearest binary float
+        return _checked_number(Fraction(repr(node.value)))
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+        value = _eval_arithmetic(node.operand)
+        return -value if isinstance(node.op, ast.USub) else value
+    if isinstance(node, ast.BinOp) and type(node.op) in _ARITHMETIC_OPS:
+        left, right = _eval_arithmetic(node.left), _eval_arithmetic(node.right)
+        if isinstance(node.op, ast.Pow):
+            if right.denominator != 1:
+                raise ValueError("Fractional exponent") # Roots are irrational or complex in general
+            # Checked before computing, so a huge power is never materialized
+            base_bits = max(left.numerator.bit_length(), left.denominator.bit_length(), 2)
+            if abs(right.numerator) * base_bits > _ARITHMETIC_MAX_BITS:
+                raise ValueError("Exponent too large")
+            right = right.numerator # Fraction ** int stays exact
+        return _checked_number(_ARITHMETIC_OPS[type(node.op)](left, right))
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _ARITHMETIC_FUNCS
+            and len(node.args) == 1 and not node.keywords):
+        return _checked_number(_ARITHMETIC_FUNCS[node.func.id](_eval_arithmetic(node.args[0])))
+    raise ValueError("Not a plain arithmetic expression")
+
+def _format_fraction(value: Fraction, decimal_input: bool) -> str:
+    """The answer as "3", "2/3" or, for problems written with decimals, "0.75"."""
+    if value.denominator == 1:
+        return str(value.numerator)
+    if decimal_input:
+        return f"{float(value):.10g}"
+    return f"{value.numerator}/{value.denominator}"
+
+def _solve_arithmetic(question_text: str) -> Optional[Dict[str, Any]]:
+    """The solver result for a plain numeric expression, or None if Gemini is needed."""
+    expression = question_text.strip().lower()
+    if len(expression) > _ARITHMETIC_MAX_LENGTH:
+        return None
+    for prefix in _ARITHMETIC_PREFIXES:
+        if expression.startswith(prefix):
+            expression = expression[len(prefix):]
+            break
+    expression = expression.strip().rstrip("?=. ").replace("^", "**").replace("×", "*").replace("÷", "/")
+    if not expression:
+        return None
     try:
-        # Use a model suitable for reasoning/math - Pro might be better than Flash
-        # model = genai.GenerativeModel('gemini-1.5-flash-latest') 
-        model = genai.GenerativeModel('gemini-1.5-flash-latest') # Try Pro for potentially better math reasoning
+        tree = ast.parse(expression, mode="eval")
+        value = _eval_arithmetic(tree.body)
+        decimal_input = any(isinstance(node, ast.Constant) and isinstance(node.value, float) for node in ast.walk(tree))
+        answer = _format_fraction(value, decimal_input)
+    except (SyntaxError, ValueError, TypeError, ZeroDivisionError, OverflowError):
+        return None # Division by zero, irrational roots, oversized results, ... are left for Gemini
+
+    return {
+        "solution": [answer],
+        "steps": [f"{expression.replace('**', '^')} = {answer}"],
+        "explanation": "Evaluated directly as an arithmetic expression.",
+        "error": None,
+    }
+
+# --- Cache Keys ---
+# Unicode math symbols -> ASCII spelling. Applied before NFKC, which would turn "x²" into "x2".
+_MATH_SYMBOL_TRANS = str.maketrans({
+    "×": "*", "·": "*", "∙": "*", "÷": "/", "−": "-", "–": "-",
+    "²": "^2", "³": "^3", "√": "sqrt", "π": "pi",
+})
 
-        # Construct the prompt - More specific for math
-        prompt = f"""You are a helpful math assistant.
+def _canonicalize_problem(question_text: str) -> str:
+    """Canonical form of a problem (ASCII operators, NFKC, lowercase, single spaces) for the solver caches."""
+    text = unicodedata.normalize("NFKC", question_text.translate(_MATH_SYMBOL_TRANS))
+    return " ".join(text.lower().split())
+
+def _problem_cache_args(question_text: str) -> List[str]:
+    """Cache key for a problem, so trivially different spellings of the same question skip Gemini."""
+    return [_canonicalize_problem(question_text)]
+
+def _today_cache_args() -> List[str]:
+    return [date.today().isoformat()]
+
+# --- Core Solving Logic (Using Gemini) ---
+# Prompt skeletons, built once at import and filled with format_map per request
+_SOLVE_PROMPT_TEMPLATE = """You are a helpful math assistant.
 Solve the following mathematical problem:
 ```
-{question_text}
+{problem}
 ```
 Provide the final answer or solution clearly.
 If applicable, provide a step-by-step derivation or calculation process.
@@ -142,17 +277,59 @@ Solution:
 If the problem is ambiguous or cannot be solved, please state why.
 """
 
+@cached_response("solve_math_problem", solver_cache, key_args=_problem_cache_args)
+async def solve_math_problem(question_text: str) -> Dict[str, Any]:
+    """Solves a math problem using the Gemini API."""
+    arithmetic_result = _solve_arithmetic(question_text)
+    if arithmetic_result is not None:
+        logger.info(f"Solved as plain arithmetic without Gemini: {question_text[:60]}")
+        return arithmetic_result
+
+    # Solved before by another worker? (Shared cache; this function's own cache is per process)
+    canonical_text = _canonicalize_problem(question_text)
+    shared_key = cache.content_key("solve", canonical_text)
+    shared_result = await cache.get_json(shared_key)
+    if shared_result is not None:
+        return shared_result
+
+    logger.info(f"Attempting to solve using Gemini: {question_text[:60]}...")
+
+    if not genai:
+        logger.error("Gemini API client not configured or key is missing.")
+        raise HTTPException(status_code=501, # 501 Not Implemented
+                            detail="Math solving via AI model is not configured on the server.")
+
+    # Near-duplicate of an already solved problem (rephrased/reformatted)? Only active if the embedding model is installed.
+    embedding = await solver_semantic_cache.embed(canonical_text)
+    cached_result = solver_semantic_cache.search(canonical_text, embedding)
+    if cached_result is not None:
+        return cached_result
+
+    # --- Call Gemini API ---
+    parsed_result = await _solve_with_gemini(question_text)
+    solver_semantic_cache.add(canonical_text, embedding, parsed_result)
+    await cache.set_json(shared_key, parsed_result, cache.SOLVE_CACHE_TTL_SECONDS)
+    return parsed_result
+
+async def _solve_with_gemini(question_text: str) -> Dict[str, Any]:
+    """One Gemini call for one problem, parsed into solution/steps/explanation."""
+    try:
+        model = _GEMINI_MODEL
+
+        prompt = _SOLVE_PROMPT_TEMPLATE.format_map({"problem": question_text})
+
         logger.info(f"Sending request to Gemini model: {model.model_name}")
-        # Use await for async call
-        response = await model.generate_content_async(prompt)
+        # Only the upstream request takes a limiter slot; cache hits and single-flight followers never get here
+        response = await llm_limiter.run(lambda: model.generate_content_async(prompt))
 
         # --- Parse Gemini Response ---
-        if response and hasattr(response, 'text'):
-            raw_response_text = response.text
-            logger.info(f"Received response from Gemini. Length: {len(raw_response_text)}")
-            logger.debug(f"Gemini Raw Response:\n{raw_response_text}")
+        raw_response_text = _response_text(response)
+        if raw_response_text:
+            logger.info("Received response from Gemini. Length: %d", len(raw_response_text))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Gemini Raw Response:\n{raw_response_text}")
 
-            # Attempt to parse the structured response
+            # Attempt to parse the structured response (the parser strips each section itself)
             parsed_result = _parse_gemini_solver_response(raw_response_text)
             logger.info("Parsed Gemini response.")
             return parsed_result
@@ -174,9 +351,19 @@ If the problem is ambiguous or cannot be solved, please state why.
         elif isinstance(e, HTTPException):
              raise e # Re-raise specific HTTP errors
         else:
-            raise HTTPException(status_code=500, detail=f"Failed to solve using AI model: {str(e)}") 
+            raise HTTPException(status_code=500, detail=f"Failed to solve using AI model: {str(e)}")
 
 # --- Practice Problem Generation (Using Gemini) ---
+_PRACTICE_PROMPT_TEMPLATE = """You are a helpful math tutor assistant.
+Generate a practice math problem that is similar in concept and difficulty to the following topic or problem:
+```
+{topic}
+```
+Present ONLY the practice problem statement itself, without any introduction, explanation, steps, or solution.
+Just provide the problem text.
+Example format: "Solve the equation 2x + 5 = 11." OR "Find the derivative of f(x) = sin(x^2)."
+"""
+
 async def generate_practice_problem(topic_or_original_problem: str) -> Dict[str, Any]:
     """Generates a practice math problem related to the input using the Gemini API."""
     logger.info(f"Attempting to generate practice problem for: {topic_or_original_problem[:60]}...")
@@ -188,27 +375,20 @@ async def generate_practice_problem(topic_or_original_problem: str) -> Dict[str,
 
     # --- Call Gemini API ---
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash-latest') # Or flash if preferred
+        model = _GEMINI_MODEL
 
-        # Construct the prompt - Ask for a similar problem
-        prompt = f"""You are a helpful math tutor assistant.
-Generate a practice math problem that is similar in concept and difficulty to the following topic or problem:
-```
-{topic_or_original_problem}
-```
-Present ONLY the practice problem statement itself, without any introduction, explanation, steps, or solution.
-Just provide the problem text.
-Example format: "Solve the equation 2x + 5 = 11." OR "Find the derivative of f(x) = sin(x^2)."
-"""
+        prompt = _PRACTICE_PROMPT_TEMPLATE.format_map({"topic": topic_or_original_problem})
 
         logger.info(f"Sending practice generation request to Gemini model: {model.model_name}")
         response = await model.generate_content_async(prompt)
 
         # --- Parse Gemini Response ---
-        if response and hasattr(response, 'text'):
-            practice_problem_text = response.text.strip()
-            logger.info(f"Received practice problem from Gemini. Length: {len(practice_problem_text)}")
-            logger.debug(f"Gemini Raw Practice Problem Response:\n{practice_problem_text}")
+        raw_response_text = _response_text(response)
+        if raw_response_text:
+            practice_problem_text = raw_response_text.strip()
+            logger.info("Received practice problem from Gemini. Length: %d", len(practice_problem_text))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Gemini Raw Practice Problem Response:\n{practice_problem_text}")
 
             # Return just the problem text
             # We might want a more structured response later, but for now, just the text.
@@ -232,53 +412,20 @@ Example format: "Solve the equation 2x + 5 = 11." OR "Find the derivative of f(x
         else:
             raise HTTPException(status_code=500, detail=f"Failed to generate practice problem using AI: {str(e)}") 
 
-async def diagnose_user_solution(problem_text: str, user_steps_str: str) -> Dict[str, Any]:
-    """
-    Diagnoses mistakes in a user's provided solution steps by comparing them
-    with a model-generated correct solution.
-    """
-    logger.info(f"Starting mistake diagnosis for problem: {problem_text[:60]}...")
-
-    if not genai:
-        logger.error("Gemini API client not configured for mistake diagnosis.")
-        raise HTTPException(status_code=501,
-                            detail="Mistake diagnosis via AI model is not configured on the server.")
-
-    try:
-        # 1. Get the correct solution and steps from the existing solver
-        logger.info("Fetching correct solution for comparison...")
-        correct_solution_data = await solve_math_problem(problem_text)
-        
-        correct_steps = correct_solution_data.get("steps")
-        correct_solution = correct_solution_data.get("solution")
-
-        if not correct_steps:
-            logger.warning("Could not retrieve correct steps for comparison.")
-            # Potentially return a message indicating correct steps couldn't be generated
-            # For now, we'll proceed and let Gemini handle it, but it might be less effective.
-            correct_steps_str = "Could not automatically determine the correct steps for this problem."
-        else:
-            correct_steps_str = "\n".join([f"{i+1}. {step}" for i, step in enumerate(correct_steps)])
-        
-        correct_solution_str = ", ".join(correct_solution) if correct_solution else "Not available"
-
-        # 2. Formulate a prompt for Gemini to compare and give feedback
-        # model = genai.GenerativeModel('gemini-1.5-flash-latest') # Can use flash for this if speed is preferred
-        model = genai.GenerativeModel('gemini-1.5-flash-latest')
-
-        prompt = f"""You are an expert math tutor.
+# Filled with format_map once the reference solution is known
+_DIAGNOSIS_PROMPT_TEMPLATE = """You are an expert math tutor.
 A student is trying to solve the following math problem:
 Problem:
 {problem_text}
 
 The student has provided the following steps for their solution:
 Student's Steps:
-{user_steps_str}
+{user_steps}
 
 For your reference, a correct step-by-step solution is:
 Correct Steps:
-{correct_steps_str}
-Correct Final Solution: {correct_solution_str}
+{correct_steps}
+Correct Final Solution: {correct_solution}
 
 Your task is to:
 1.  Analyze the student's steps carefully.
@@ -302,13 +449,58 @@ If the student's solution is entirely correct, you can say something like:
 Provide only the feedback to the student.
 """
 
-        logger.info("Sending request to Gemini for mistake diagnosis...")
-        response = await model.generate_content_async(prompt)
+async def _build_diagnosis_prompt(problem_text: str, user_steps_str: str) -> str:
+    """Solves the problem for a reference solution and fills the diagnosis prompt with it."""
+    # Reference solution; a repeat problem is served from the solver cache
+    logger.info("Fetching correct solution for comparison...")
+    prompt_fields = {"problem_text": problem_text, "user_steps": user_steps_str}
 
-        if response and hasattr(response, 'text'):
-            feedback_text = response.text.strip()
-            logger.info(f"Received diagnosis feedback from Gemini. Length: {len(feedback_text)}")
-            logger.debug(f"Gemini Diagnosis Feedback:\n{feedback_text}")
+    try:
+        correct_solution_data = await solve_math_problem(problem_text)
+    except HTTPException as solve_exc:
+        if solve_exc.status_code == 401:
+            raise
+        # Diagnose without a reference solution rather than failing the whole request
+        logger.warning(f"Reference solution failed ({solve_exc.detail}); diagnosing without it.")
+        correct_solution_data = {}
+
+    correct_steps = correct_solution_data.get("steps")
+    correct_solution = correct_solution_data.get("solution")
+
+    if not correct_steps:
+        logger.warning("Could not retrieve correct steps for comparison.")
+        # Proceed and let Gemini handle it, but it might be less effective.
+        prompt_fields["correct_steps"] = "Could not automatically determine the correct steps for this problem."
+    else:
+        prompt_fields["correct_steps"] = "\n".join(f"{i}. {step}" for i, step in enumerate(correct_steps, 1))
+    prompt_fields["correct_solution"] = ", ".join(correct_solution) if correct_solution else "Not available"
+    return _DIAGNOSIS_PROMPT_TEMPLATE.format_map(prompt_fields)
+
+async def diagnose_user_solution(problem_text: str, user_steps_str: str) -> Dict[str, Any]:
+    """
+    Diagnoses mistakes in a user's provided solution steps by comparing them
+    with a model-generated correct solution.
+    """
+    logger.info(f"Starting mistake diagnosis for problem: {problem_text[:60]}...")
+
+    if not genai:
+        logger.error("Gemini API client not configured for mistake diagnosis.")
+        raise HTTPException(status_code=501,
+                            detail="Mistake diagnosis via AI model is not configured on the server.")
+
+    try:
+        prompt = await _build_diagnosis_prompt(problem_text, user_steps_str)
+        model = _GEMINI_MODEL
+
+        logger.info("Sending request to Gemini for mistake diagnosis...")
+        response = await llm_limiter.run(lambda: model.generate_content_async(prompt))
+
+        raw_response_text = _response_text(response)
+        if raw_response_text:
+            feedback_text = raw_response_text.strip()
+            logger.info("Received diagnosis feedback from Gemini. Length: %d", len(feedback_text))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Gemini Diagnosis Feedback:\n{feedback_text}")
             return {"feedback": feedback_text, "error": None}
         
         elif response and hasattr(response, 'prompt_feedback') and response.prompt_feedback.block_reason:
@@ -329,6 +521,21 @@ Provide only the feedback to the student.
         else:
             raise HTTPException(status_code=500, detail=f"Failed to diagnose mistake using AI model: {str(e)}") 
 
+# JSON mode: Gemini returns exactly this object, so no fence/brace extraction is needed
+_PUZZLE_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": {
+        "type": "object",
+        "properties": {
+            "question": {"type": "string"},
+            "answer": {"type": "string"},
+            "difficulty": {"type": "string", "enum": ["easy", "medium", "hard"]},
+        },
+        "required": ["question", "answer", "difficulty"],
+    },
+}
+
+@cached_response("daily_math_puzzle", solver_cache, key_args=_today_cache_args) # One generation per day, even under concurrent first requests
 async def generate_daily_math_puzzle() -> Dict[str, Any]:
     """Generates a daily math puzzle using the Gemini API.
 
@@ -344,7 +551,7 @@ async def generate_daily_math_puzzle() -> Dict[str, Any]:
                             detail="Daily puzzle generation via AI model is not configured.")
 
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash-latest')
+        model = _GEMINI_MODEL
 
         prompt = """You are a creative puzzle generator.
 Generate a unique and engaging math puzzle suitable for a general audience.
@@ -366,24 +573,17 @@ Do not include any other text, explanations, or markdown formatting outside of t
 """
 
         logger.info(f"Sending daily puzzle generation request to Gemini model: {model.model_name}")
-        response = await model.generate_content_async(prompt)
+        response = await model.generate_content_async(prompt, generation_config=_PUZZLE_GENERATION_CONFIG)
 
-        if response and hasattr(response, 'text'):
-            raw_response_text = response.text.strip()
-            logger.info(f"Received response from Gemini for daily puzzle. Length: {len(raw_response_text)}")
-            logger.debug(f"Gemini Raw Daily Puzzle Response:\\n{raw_response_text}")
+        raw_response_text = _response_text(response)
+        if raw_response_text:
+            logger.info("Received response from Gemini for daily puzzle. Length: %d", len(raw_response_text))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Gemini Raw Daily Puzzle Response:\n{raw_response_text}")
 
             try:
                 # Attempt to parse the JSON response
-                import json # Import json here as it's only used in this part
-                payload_match = re.search(r'```json\\n({.*?})\\n```', raw_response_text, re.DOTALL)
-                if payload_match:
-                    json_text = payload_match.group(1)
-                else:
-                    # Fallback: assume the whole response is JSON if no markdown triple quotes
-                    json_text = raw_response_text
-                
-                puzzle_data = json.loads(json_text)
+                puzzle_data = orjson.loads(raw_response_text) # Accepts str directly
 
                 if not all(k in puzzle_data for k in ["question", "answer", "difficulty"]):
                     logger.error(f"Gemini response for daily puzzle missing required keys. Got: {puzzle_data.keys()}")
@@ -404,7 +604,7 @@ Do not include any other text, explanations, or markdown formatting outside of t
                     "difficulty": str(puzzle_data["difficulty"]).lower()
                 }
 
-            except json.JSONDecodeError as jde:
+            except orjson.JSONDecodeError as jde: # Subclass of json.JSONDecodeError
                 logger.error(f"Failed to decode JSON from Gemini daily puzzle response: {jde}. Response was: {raw_response_text}")
                 raise HTTPException(status_code=500, detail=f"AI returned invalid JSON for the daily puzzle. {str(jde)}")
             except Exception as e: # Catch other parsing errors
@@ -428,4 +628,76 @@ Do not include any other text, explanations, or markdown formatting outside of t
         if "api key" in err_str or "permission denied" in err_str or "authentication" in err_str:
              raise HTTPException(status_code=401, detail="AI API Error for daily puzzle: Invalid API Key or Authentication Failed.")
         else:
-            raise HTTPException(status_code=500, detail=f"Failed to generate daily puzzle using AI model: {str(e)}") 
\ No newline at end of file
+            raise HTTPException(status_code=500, detail=f"Failed to generate daily puzzle using AI model: {str(e)}")
+
+# --- Streaming (Server-Sent Events endpoints) ---
+def is_configured() -> bool:
+    return _GEMINI_MODEL is not None
+
+async def _stream_gemini_text(prompt: str) -> AsyncIterator[str]:
+    """Yields Gemini's response text chunk by chunk as it is generated.
+
+    Holds an llm_limiter slot until the stream ends, so streams count against the same upstream limit.
+    """
+    async with llm_limiter.slot():
+        response = await llm_limiter.timed(_GEMINI_MODEL.generate_content_async(prompt, stream=True))
+        received_text = False
+        chunks = response.__aiter__()
+        while True:
+            try:
+                chunk = await llm_limiter.timed(chunks.__anext__()) # A stalled stream gives up its slot
+            except StopAsyncIteration:
+                break
+            text = _response_text(chunk)
+            if text:
+                received_text = True
+                yield text
+    if not received_text:
+        block_reason = getattr(getattr(response, "prompt_feedback", None), "block_reason", None)
+        if block_reason:
+            raise HTTPException(status_code=400, detail=f"Content generation blocked by API. Reason: {block_reason}")
+        raise HTTPException(status_code=500, detail="AI returned an unexpected or empty response.")
+
+async def stream_math_solution(question_text: str) -> AsyncIterator[Dict[str, Any]]:
+    """Streaming solve_math_problem: yields {"text": chunk} while Gemini writes, then {"result": parsed}.
+
+    Cached solutions are yielded straight away as the result; new ones are added to the same caches.
+    """
+    arithmetic_result = _solve_arithmetic(question_text)
+    if arithmetic_result is not None:
+        yield {"result": arithmetic_result}
+        return
+
+    canonical_text = _canonicalize_problem(question_text)
+    cache_key = make_cache_key("solve_math_problem", args=[canonical_text]) # Same key as solve_math_problem's cache
+    cached_result = solver_cache.get(cache_key)
+    shared_key = cache.content_key("solve", canonical_text)
+    if cached_result is None:
+        cached_result = await cache.get_json(shared_key)
+    embedding = None
+    if cached_result is None:
+        embedding = await solver_semantic_cache.embed(canonical_text)
+        cached_result = solver_semantic_cache.search(canonical_text, embedding)
+    if cached_result is not None:
+        yield {"result": cached_result}
+        return
+
+    logger.info(f"Streaming Gemini solution for: {question_text[:60]}...")
+    chunks: List[str] = []
+    async for text in _stream_gemini_text(_SOLVE_PROMPT_TEMPLATE.format_map({"problem": question_text})):
+        chunks.append(text)
+        yield {"text": text}
+
+    # The structured parse needs the whole response
+    parsed_result = _parse_gemini_solver_response("".join(chunks))
+    solver_cache.set(cache_key, parsed_result)
+    solver_semantic_cache.add(canonical_text, embedding, parsed_result)
+    await cache.set_json(shared_key, parsed_result, cache.SOLVE_CACHE_TTL_SECONDS)
+    yield {"result": parsed_result}
+
+async def stream_diagnosis(problem_text: str, user_steps_str: str) -> AsyncIterator[str]:
+    """Streaming diagnose_user_solution: yields the feedback text as Gemini writes it."""
+    prompt = await _build_diagnosis_prompt(problem_text, user_steps_str)
+    logger.info(f"Streaming mistake diagnosis for problem: {problem_text[:60]}...")
+    async for text in _stream_gemini_text(prompt):
+        yield text
@@ -1,33 +1,163 @@
 """Text-to-Speech (TTS) Utilities"""
+import asyncio
+import hashlib
 import logging
 import io
+import os
+import threading
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from cachetools import LRUCache
 from gtts import gTTS
 from fastapi import HTTPException
+from . import config
 
 logger = logging.getLogger(__name__)
 
-async def text_to_speech(text: str) -> io.BytesIO:
-    """Converts text to speech using gTTS and returns an in-memory MP3 audio stream."""
+# --- Optional: Piper (local, ONNX Runtime) ---
+_piper_voice = None
+try:
+    if config.PIPER_VOICE_PATH:
+        from piper import PiperVoice
+        _piper_voice = PiperVoice.load(config.PIPER_VOICE_PATH) # Loaded once at import
+        logger.info(f"Piper TTS enabled with voice {config.PIPER_VOICE_PATH}.")
+except ImportError:
+    logger.warning("PIPER_VOICE_PATH is set but piper-tts is not installed. Using gTTS.")
+except Exception as e:
+    logger.error(f"Error loading Piper voice {config.PIPER_VOICE_PATH}: {e}. Using gTTS.")
+    _piper_voice = None
+
+# Format of the clips text_to_speech returns (Piper writes WAV, gTTS MP3)
+AUDIO_MEDIA_TYPE = "audio/wav" if _piper_voice else "audio/mpeg"
+_AUDIO_EXTENSION = "wav" if _piper_voice else "mp3"
+
+# --- TTS Cache Settings ---
+TTS_CACHE_MAXSIZE = 256 # Clips kept in memory (short tutoring phrases repeat a lot)
+TTS_DISK_CACHE_DIR = config.TTS_DISK_CACHE_DIR # Second tier; survives restarts
+TTS_DISK_CACHE_MAX_BYTES = config.TTS_DISK_CACHE_MAX_BYTES
+TTS_DISK_CACHE_TRIM_RATIO = 0.9 # Eviction trims down to this fraction of the cap so it doesn't run on every write
+TTS_MAX_WORKERS = 8 # Concurrent syntheses; a dedicated pool so TTS can't starve the default executor
+
+_tts_executor = ThreadPoolExecutor(max_workers=TTS_MAX_WORKERS, thread_name_prefix="tts")
+
+_tts_cache: LRUCache = LRUCache(maxsize=TTS_CACHE_MAXSIZE) # Text hash -> audio bytes
+
+def _tts_cache_key(text: str) -> str:
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+def _synthesize_piper(text: str) -> bytes:
+    """Blocking on-device synthesis (no network round trip)."""
+    audio_fp = io.BytesIO()
+    with wave.open(audio_fp, "wb") as wav_file:
+        # piper-tts >= 1.3 renamed the WAV writer to synthesize_wav
+        synthesize_wav = getattr(_piper_voice, "synthesize_wav", None) or _piper_voice.synthesize
+        synthesize_wav(text, wav_file)
+    return audio_fp.getvalue()
+
+def _synthesize(text: str) -> bytes:
+    """Blocking synthesis: Piper when a local voice is configured, else gTTS (an HTTPS round trip to Google)."""
+    if _piper_voice:
+        return _synthesize_piper(text)
+    tts = gTTS(text=text, lang='en', slow=False) # slow=False for normal speed
+    audio_fp = io.BytesIO()
+    tts.write_to_fp(audio_fp)
+    return audio_fp.getvalue()
+
+_disk_cache_lock = threading.Lock() # Writes run on several TTS pool threads
+_disk_cache_bytes: Optional[int] = None # Approximate size of the directory; scanned on first write
+
+def _disk_cache_path(key: str) -> str:
+    return os.path.join(TTS_DISK_CACHE_DIR, f"{key}.{_AUDIO_EXTENSION}")
+
+def _read_disk_cache(key: str) -> Optional[bytes]:
+    path = _disk_cache_path(key)
+    try:
+        with open(path, "rb") as f:
+            audio = f.read()
+        os.utime(path) # Bump mtime so eviction is least-recently-used
+        return audio
+    except OSError:
+        return None
+
+def _disk_cache_entries() -> list:
+    """(mtime, size, path) for every cached clip."""
+    entries = []
+    with os.scandir(TTS_DISK_CACHE_DIR) as it:
+        for entry in it:
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    return entries
+
+def _evict_disk_cache() -> int:
+    """Deletes least recently used clips until the directory is under the trim target; returns the new total."""
+    entries = sorted(_disk_cache_entries())
+    total = sum(size for _, size, _ in entries)
+    target = TTS_DISK_CACHE_MAX_BYTES * TTS_DISK_CACHE_TRIM_RATIO
+    for _, size, path in entries:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError: # Already removed by another worker
+            pass
+    return total
+
+def _write_disk_cache(key: str, audio: bytes) -> None:
+    global _disk_cache_bytes
+    try:
+        with _disk_cache_lock:
+            if _disk_cache_bytes is None:
+                os.makedirs(TTS_DISK_CACHE_DIR, mode=0o700, exist_ok=True)
+                os.chmod(TTS_DISK_CACHE_DIR, 0o700) # Clips can contain user text; keep them private
+                _disk_cache_bytes = sum(size for _, size, _ in _disk_cache_entries())
+            path = _disk_cache_path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(audio)
+            os.replace(tmp_path, path) # Atomic, so a concurrent reader never sees a partial file
+            _disk_cache_bytes += len(audio)
+            if _disk_cache_bytes > TTS_DISK_CACHE_MAX_BYTES:
+                _disk_cache_bytes = _evict_disk_cache()
+    except OSError as e:
+        logger.warning(f"Could not write TTS disk cache entry {key}: {e}")
+
+def _load_or_synthesize(key: str, text: str) -> bytes:
+    audio = _read_disk_cache(key)
+    if audio is None:
+        audio = _synthesize(text)
+        _write_disk_cache(key, audio)
+    return audio
+
+async def text_to_speech(text: str) -> bytes:
+    """Converts text to speech (Piper or gTTS) and returns the audio (AUDIO_MEDIA_TYPE) as bytes.
+
+    Clips are cached in memory and on disk; synthesis runs in the TTS thread pool so it doesn't block the event loop.
+    """
+    key = _tts_cache_key(text)
+    audio = _tts_cache.get(key)
+    if audio is not None:
+        logger.info(f"TTS cache hit for text: '{text[:50]}...'")
+        return audio
+
     logger.info(f"Generating TTS for text: '{text[:50]}...'")
     try:
-        tts = gTTS(text=text, lang='en', slow=False) # slow=False for normal speed
-        
-        # Save the audio to an in-memory file
-        audio_fp = io.BytesIO()
-        tts.write_to_fp(audio_fp)
-        audio_fp.seek(0) # Rewind the file pointer to the beginning
+        audio = await asyncio.get_running_loop().run_in_executor(_tts_executor, _load_or_synthesize, key, text)
+        _tts_cache[key] = audio
 
-        logger.info(f"Successfully generated TTS audio stream.")
-        return audio_fp
+        logger.info(f"Successfully generated TTS audio.")
+        return audio
 
     except Exception as e:
-        logger.error(f"gTTS failed to generate speech for '{text[:50]}...': {e}", exc_info=True)
+        logger.error(f"TTS failed to generate speech for '{text[:50]}...': {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Text-to-Speech generation failed: {str(e)}")
 
 # Placeholder for speech synthesis functions
-async def text_to_speech_placeholder(text: str) -> io.BytesIO:
-    print(f"[Placeholder] text_to_speech called for: {text[:30]}...")
+async def text_to_speech_placeholder(text: str) -> bytes:
+    logger.info(f"[Placeholder] text_to_speech called for: {text[:30]}...")
     # In a real implementation, this would call a TTS API (e.g., Google TTS)
-    # and return an audio stream (like MP3 data) in a BytesIO object.
+    # and return the audio (like MP3 data) as bytes.
     # For now, return empty bytes.
-    return io.BytesIO(b"") 
\ No newline at end of file
+    return b""
@@ -0,0 +1,46 @@
+"""Server-Sent Events framing shared by the streaming endpoints."""
+from typing import Any, AsyncIterator, Dict, Optional
+
+import orjson
+from fastapi import HTTPException
+
+
+def sse_event(data: Dict[str, Any], event: Optional[str] = None) -> bytes:
+    """Formats one Server-Sent Event. Data is JSON-encoded so newlines in the AI text don't break the framing."""
+    prefix = f"event: {event}\n".encode() if event else b""
+    return b"%sdata: %s\n\n" % (prefix, orjson.dumps(data))
+
+
+def sse_error(e: Exception) -> bytes:
+    """An "error" event. Headers are already sent, so errors are reported in-band instead of as an HTTP status."""
+    detail = e.detail if isinstance(e, HTTPException) else f"AI Streaming Error: {str(e)}"
+    return sse_event({"detail": detail}, event="error")
+
+
+async def _chain(first: Any, rest: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    yield first
+    async for item in rest:
+        yield item
+
+
+async def _raise_in_stream(error: Exception) -> AsyncIterator[Any]:
+    raise error
+    yield # Makes this an async generator
+
+
+async def prime_stream(stream: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    """Waits for `stream`'s first item before the response starts and returns an iterator over all its items.
+
+    An HTTPException raised before any output (e.g. the upstream limiter's 503 + Retry-After) propagates and
+    becomes the response status; other errors are left for the stream to report in-band.
+    """
+    iterator = stream.__aiter__()
+    try:
+        first = await iterator.__anext__()
+    except StopAsyncIteration:
+        return iterator # Already exhausted
+    except HTTPException:
+        raise
+    except Exception as e:
+        return _raise_in_stream(e)
+    return _chain(first, iterator)
@@ -0,0 +1,35 @@
+"""Tests for the OCR upload sniffing."""
+import io
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+pytest.importorskip("fastapi")
+
+from fastapi import HTTPException
+
+from backend import ocr
+
+
+def _image_bytes(fmt: str, **save_kwargs) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (8, 8), "white").save(buf, format=fmt, **save_kwargs)
+    return buf.getvalue()
+
+
+def test_sniff_jpeg():
+    assert ocr._sniff_image_mime_type(_image_bytes("JPEG"), "photo.jpg") == "image/jpeg"
+
+
+def test_sniff_mpo_phone_jpeg_is_jpeg():
+    # Phone cameras write multi-picture JPEGs, which Pillow reports as "MPO"
+    mpo_bytes = _image_bytes("MPO", save_all=True, append_images=[Image.new("RGB", (8, 8), "black")])
+    with Image.open(io.BytesIO(mpo_bytes)) as img:
+        assert img.format == "MPO"
+    assert ocr._sniff_image_mime_type(mpo_bytes, "IMG_0001.jpg") == "image/jpeg"
+
+
+def test_sniff_rejects_non_image():
+    with pytest.raises(HTTPException) as exc_info:
+        ocr._sniff_image_mime_type(b"not an image", "notes.png")
+    assert exc_info.value.status_code == 415
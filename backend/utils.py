@@ -16,5 +16,5 @@ logger = logging.getLogger(__name__)
 # Placeholder for utility functions
 
 def some_utility_function():
-    print("[Placeholder] Utility function called")
+    logger.info("[Placeholder] Utility function called")
     pass 
\ No newline at end of file
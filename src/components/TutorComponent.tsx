@@ -188,6 +188,7 @@ const TutorComponent: React.FC = () => {
   const [imagePreviewUrl, setImagePreviewUrl] = useState<string | null>(null);
   const [loadingOcr, setLoadingOcr] = useState(false);
   const [ocrApiError, setOcrApiError] = useState<string | null>(null); // Dedicated error state for OCR
+  const [ocrImageHash, setOcrImageHash] = useState<string | null>(null); // Hash of the last OCR'd image, saved with bookmarks
 
   // --- State for Voice Input ---
   const [isRecording, setIsRecording] = useState<boolean>(false);
@@ -513,6 +514,7 @@ const TutorComponent: React.FC = () => {
       // Assume backend endpoint for OCR is /upload-image
       const response = await fetch(`${API_BASE_URL}/upload-image`, {
         method: "POST",
+        headers: { ...getAuthHeader() }, // Lets the backend reuse text from a bookmarked copy of this image
         body: formData,
       });
 
@@ -526,6 +528,7 @@ const TutorComponent: React.FC = () => {
       if (data.status === "success" && data.extracted_text !== undefined) {
         const extracted = data.extracted_text || "";
         setProblemInput(extracted); // <-- SET THE MAIN PROBLEM INPUT
+        setOcrImageHash(data.image_hash || null);
          toast({
            title: "Text Extracted",
            description: extracted ? "Review text in the input area below." : "No text found in image.",
@@ -731,6 +734,7 @@ const TutorComponent: React.FC = () => {
               setLoadingOcr(true); // Use the OCR loading state
               const response = await fetch(`${API_BASE_URL}/upload-image`, {
                 method: "POST",
+                headers: { ...getAuthHeader() },
                 body: formData,
               });
 
@@ -744,6 +748,7 @@ const TutorComponent: React.FC = () => {
               if (data.status === "success" && data.extracted_text !== undefined) {
                 const extracted = data.extracted_text || "";
                 setProblemInput(extracted); // <-- SET THE MAIN PROBLEM INPUT
+                setOcrImageHash(data.image_hash || null);
                  toast({
                    title: "Text Extracted from Camera",
                    description: extracted ? "Review text in the input area below." : "No text found in captured image.",
@@ -1080,7 +1085,9 @@ const TutorComponent: React.FC = () => {
         body: JSON.stringify({
           question_text: problemToBookmark,
           question_source: "main_solved_problem",
-          metadata_json: solution ? { steps: solution.steps.map(s => ({ step_number: s.step_number, explanation: s.explanation })), final_answer: solution.final_answer } : null,
+          metadata_json: solution
+            ? { steps: solution.steps.map(s => ({ step_number: s.step_number, explanation: s.explanation })), final_answer: solution.final_answer, ...(ocrImageHash ? { image_hash: ocrImageHash } : {}) }
+            : (ocrImageHash ? { image_hash: ocrImageHash } : null),
         }),
       });
 